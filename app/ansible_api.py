@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 # Author: Yujichang
 
+import os
 import json
+import time
 import shutil
 import ansible.constants as C
 from ansible.module_utils.common.collections import ImmutableDict
@@ -14,31 +16,167 @@ from ansible.executor.task_queue_manager import TaskQueueManager
 from ansible.plugins.callback import CallbackBase
 from ansible import context
 from ansible.executor.playbook_executor import PlaybookExecutor
+from app.result import ResultStore, compact_result, truncate_output
+from app.inventory import InventoryIndex
+
+
+# 连接配置，performance 使用更长时间的 ssh 长连接复用和 pipelining，
+# 减少每个模块执行时的 ssh 握手和临时文件传输，安装包本身已压缩，不再开启 ssh 压缩
+CONNECTION_PROFILES = {
+    'default': {},
+    'performance': {
+        'ansible_ssh_args': '-o ControlMaster=auto -o ControlPersist=30m -o ServerAliveInterval=30',
+        'ansible_control_path': '%(directory)s/%%C',
+        'ansible_pipelining': True,
+    },
+}
 
 
 class ResultCallback(CallbackBase):
     """
-    回调函数
+    回调函数，每个主机事件产生时即写入事件日志并通知订阅者
+    只保留精简后的结果，失败主机的完整输出写入 failure_dir 下按主机命名的文件，
+    设置了探测任务变量 PROBE_VARS 的任务失败是预期结果，不写入
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, event_log=None, max_output=4096, failure_dir=None, **kwargs):
         super(ResultCallback, self).__init__(*args, **kwargs)
-        self.host_ok = {}
-        self.host_unreachable = {}
-        self.host_failed = {}
+        # 按执行顺序记录每台主机的结果
+        self.results = ResultStore()
+
+        # 每个输出字段保留的最大字符数，失败主机完整输出的保存目录，为空时不保存
+        self.max_output = max_output
+        self.failure_dir = failure_dir
+
+        # 追加写入的 JSONL 事件日志路径，为空时不写入
+        self.event_log = event_log
+        self._event_file = None
+        self._event_pid = None
+        # 事件订阅函数，参数为事件字典
+        self.subscribers = []
+        # 当前执行的安装阶段名称，设置后记录在事件中
+        self.stage = None
+
+        # 任务和主机开始执行的时间，用于计算每台主机的耗时
+        self._task_start = time.time()
+        self._host_start = {}
+
+    def _write_event(self, event):
+        # fork 出的子进程重新打开文件，追加模式下每行一次写入，多个进程写入不会交错
+        if self._event_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.event_log)), exist_ok=True)
+            self._event_file = open(self.event_log, 'a', buffering=1)
+            self._event_pid = os.getpid()
+        self._event_file.write(json.dumps(event) + '\n')
+
+    def _spill(self, host, result, status):
+        """
+        失败主机的完整输出追加写入 failure_dir/主机.log，返回文件路径
+        """
+        os.makedirs(self.failure_dir, exist_ok=True)
+        path = os.path.join(self.failure_dir, f'{host}.log')
+        raw = result._result
+        other = {key: value for key, value in raw.items()
+                 if key not in ('stdout', 'stderr', 'stdout_lines', 'stderr_lines')}
+
+        header = [time.strftime('%Y-%m-%d %H:%M:%S'), self.stage, result._task.get_name(), status]
+        lines = ['=== ' + ' '.join(item for item in header if item)]
+        for key in ('stdout', 'stderr'):
+            if raw.get(key):
+                lines += [f'--- {key}', str(raw[key])]
+        lines += ['--- result', json.dumps(other, indent=2, ensure_ascii=False, default=str)]
+
+        # 每次失败一次写入，并发执行的阶段写入同一台主机的文件时不会交错
+        with open(path, 'a') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
+
+    def _finish(self, result, status):
+        host = result._host.get_name()
+        now = time.time()
+        start = self._host_start.pop((host, result._task._uuid), self._task_start)
+
+        if status != 'skipped':
+            compact = compact_result(result._result, self.max_output)
+            compact['duration'] = round(now - start, 3)
+            if status != 'success' and self.failure_dir and not result._task.vars.get('result_probe'):
+                compact['output_file'] = self._spill(host, result, status)
+            self.results.add(host, status, compact)
+
+        self._emit(result, status, host, now, start)
+
+    def _emit(self, result, status, host, now, start):
+        event = dict(time=round(now, 3), host=host, task=result._task.get_name(), task_id=result._task._uuid,
+                     status=status,
+                     duration=round(now - start, 3), changed=bool(result._result.get('changed', False)))
+        if self.stage:
+            event['stage'] = self.stage
+        if status in ('failed', 'unreachable'):
+            event['msg'] = truncate_output(result._result.get('msg', result._result.get('stderr', '')), self.max_output)
+
+        if self.event_log:
+            self._write_event(event)
+        for subscriber in self.subscribers:
+            subscriber(event)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_start = time.time()
+
+    def v2_runner_on_start(self, host, task):
+        self._host_start[(host.get_name(), task._uuid)] = time.time()
 
     def v2_runner_on_unreachable(self, result):
-        self.host_unreachable[result._host.get_name()] = result
+        self._finish(result, 'unreachable')
 
     def v2_runner_on_ok(self, result, *args, **kwargs):
-        self.host_ok[result._host.get_name()] = result
+        self._finish(result, 'success')
 
     def v2_runner_on_failed(self, result, *args, **kwargs):
-        self.host_failed[result._host.get_name()] = result
+        self._finish(result, 'failed')
+
+    def v2_runner_on_skipped(self, result, *args, **kwargs):
+        self._finish(result, 'skipped')
+
+    def cleanup(self):
+        self.results = ResultStore()
+
+
+class AsyncJob(object):
+    """
+    异步任务句柄，jids 为还未完成的主机和 job id，完成和启动失败的主机结果记录在 results 中
+    deadline 为任务最长执行时间到达的时刻，超过后还未完成的主机按失败处理
+    """
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.jids = {}
+        self.results = ResultStore()
+
+    def finish(self, host, status, result):
+        del self.jids[host]
+        self.results.add(host, status, result)
+
+    @property
+    def finished(self):
+        return not self.jids
+
+
+class SessionTaskQueueManager(TaskQueueManager):
+    """
+    会话内复用的 TaskQueueManager，每次执行结束时不做清理，
+    由 MyAnsible.close 统一关闭
+    """
+    def reset(self):
+        # 清除上一次执行遗留的失败、不可达主机和主机限制，避免影响下一次执行
+        self.clear_failed_hosts()
+        self._unreachable_hosts.clear()
+        self._inventory.remove_restriction()
 
     def cleanup(self):
-        self.host_ok.clear()
-        self.host_failed.clear()
-        self.host_unreachable.clear()
+        pass
+
+    def close(self):
+        super(SessionTaskQueueManager, self).cleanup()
 
 
 class MyAnsible(object):
@@ -56,7 +194,12 @@ class MyAnsible(object):
                  verbosity=3,
                  syntax=None,
                  start_at_task=None,
-                 inventory=None):
+                 inventory=None,
+                 forks=None,
+                 strategy='linear',
+                 event_log=None,
+                 max_output=4096,
+                 failure_dir=None):
 
         """
         初始化函数，定义的默认的选项值，
@@ -78,8 +221,18 @@ class MyAnsible(object):
             listtags=listtags,
             syntax=syntax,
             start_at_task=start_at_task,
+            forks=forks,
         )
 
+        # 并发执行的主机数，为空时使用 ansible 默认值 5
+        self.forks = forks
+
+        # 任务执行策略，linear：每个任务等所有主机完成后才执行下一个任务；free：每台主机独立执行任务列表
+        self.strategy = strategy
+
+        # 运行失败的主机，由 run_task_list 等任务函数记录，分批执行时用于排除失败主机和统计失败比例
+        self.failed_hosts = set()
+
         self.inventory = inventory if inventory else "localhost,"
 
         # 实例化数据解析器
@@ -91,47 +244,221 @@ class MyAnsible(object):
         # 设置密码，当为空时使用免密登录
         self.passwords = remote_password
 
-        # 实例化回调插件对象
-        self.results_callback = ResultCallback()
+        # 实例化回调插件对象，event_log 为每个主机事件追加写入的 JSONL 文件，
+        # 结果只保留 max_output 个字符的输出，失败主机的完整输出写入 failure_dir
+        self.results_callback = ResultCallback(event_log=event_log, max_output=max_output, failure_dir=failure_dir)
 
         # 变量管理器
         self.variable_manager = VariableManager(self.loader, self.inv_obj)
 
+        # 资产快照，第一次使用时建立
+        self._index = None
+
+        # 长期执行上下文，open 之后所有执行复用同一个 TaskQueueManager
+        self._tqm = None
+        self._tqm_pid = None
+        # 本地临时目录由 fork 出的子进程共用，只在创建实例的进程中删除
+        self._pid = os.getpid()
+
+    def _cleanup_local_tmp(self):
+        self.loader.cleanup_all_tmp_files()
+        if os.getpid() == self._pid:
+            shutil.rmtree(C.DEFAULT_LOCAL_TMP, True)
+
+    @property
+    def index(self):
+        """
+        资产快照 InventoryIndex，整个会话只建立一次，fork 出的子进程直接继承
+        """
+        if self._index is None:
+            self._index = InventoryIndex(self.inv_obj, self.loader)
+        return self._index
+
+    def subscribe(self, subscriber):
+        """
+        订阅主机事件，每个主机的任务结果产生时调用 subscriber(event)
+        事件字段：time、host、task、task_id、status、duration、changed，安装阶段中执行时有 stage，失败时有 msg
+        """
+        self.results_callback.subscribers.append(subscriber)
+
+    def set_connection_profile(self, profile):
+        """
+        使用连接配置，配置项见 CONNECTION_PROFILES
+        """
+        self.variable_manager.extra_vars.update(CONNECTION_PROFILES[profile])
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _session_tqm(self):
+        # fork 出的子进程不能复用父进程的队列，需要各自开启会话
+        if self._tqm is not None and self._tqm_pid == os.getpid():
+            return self._tqm
+        return None
+
+    def open(self):
+        """
+        开启长期执行上下文，TaskQueueManager、数据解析器缓存和本地临时目录
+        在 close 之前一直保留，供所有 run、run_tasks、playbook 调用复用
+        """
+        if self._session_tqm() is None:
+            self._tqm = SessionTaskQueueManager(
+                inventory=self.inv_obj,
+                variable_manager=self.variable_manager,
+                loader=self.loader,
+                passwords=self.passwords,
+                stdout_callback=self.results_callback,
+                forks=self.forks
+            )
+            self._tqm_pid = os.getpid()
+
+    def close(self):
+        """
+        关闭长期执行上下文，整个会话结束时调用一次
+        """
+        tqm = self._session_tqm()
+        self._tqm = None
+        self._tqm_pid = None
+
+        if tqm is not None:
+            tqm.close()
+            self._cleanup_local_tmp()
+
     def run(self, hosts='localhost', gether_facts="no", task=None, task_time=0):
         """
         参数说明：
-        task_time -- 执行异步任务时等待的秒数，这个需要大于 0 ，等于 0 的时候不支持异步（默认值）
+        task_time -- 大于 0 时以异步方式执行并轮询到完成，为任务最长执行秒数；等于 0 时同步执行（默认值）
         """
         if task is None:
-            task = dict(action=dict(module='ping', args=''), async=task_time, poll=0)
-        else:
-            task['async'] = task_time
-            task['poll'] = 0
+            task = dict(action=dict(module='ping', args=''))
+
+        if task_time > 0:
+            job = self.start_async(hosts, task, task_time)
+            self.wait_async([job])
+            self.results_callback.results = job.results
+            return
 
         play_source = dict(
             name="Ad-hoc",
             hosts=hosts,
             gather_facts=gether_facts,
+            strategy=self.strategy,
             tasks=[task]
         )
 
+        self._run_play(play_source)
+
+    def start_async(self, hosts, task, timeout, name=None):
+        """
+        以异步方式启动任务，不等待执行完成，之后通过 wait_async 等待
+        :param timeout: 任务最长执行秒数
+        :return: AsyncJob
+        """
+        task = dict(task)
+        task['async'] = timeout
+        task['poll'] = 0
+        self.run_tasks(hosts=hosts, tasks=[task])
+
+        job = AsyncJob(name if name else hosts, timeout)
+        for host, status, result in self.get_task_result():
+            if status == 'success' and 'ansible_job_id' in result:
+                job.jids[host] = result['ansible_job_id']
+            else:
+                job.results.add(host, status, result)
+        return job
+
+    def wait_async(self, jobs, interval=5):
+        """
+        轮询异步任务直到全部完成，每一轮所有任务的所有主机在同一个 play 中查询状态
+        查询失败（如 job 文件已被清理）或超过任务最长执行时间的主机按失败处理
+        :param jobs: AsyncJob 列表
+        :param interval: 轮询间隔秒数
+        """
+        while True:
+            pending = {}
+            owner = {}
+            for job in jobs:
+                for host, jid in job.jids.items():
+                    pending.setdefault(host, []).append(jid)
+                    owner[jid] = job
+            if not pending:
+                return jobs
+
+            time.sleep(interval)
+            for host, jids in pending.items():
+                self.variable_manager.set_host_variable(host, 'async_jids', jids)
+            task = dict(action=dict(module='async_status', args='jid={{ item }}'), loop='{{ async_jids }}')
+            self.run_tasks(hosts=','.join(pending) + ',', tasks=[task])
+
+            for host, status, result in self.get_task_result():
+                items = result.get('results')
+                if status != 'success' and not isinstance(items, list):
+                    # 主机不可达或 async_status 本身执行失败，没有每个 job 的结果
+                    for jid in pending[host]:
+                        owner[jid].finish(host, status, result)
+                    continue
+
+                for item in items or []:
+                    job = owner.get(item.get('item'))
+                    if job is None or host not in job.jids:
+                        continue
+                    if item.get('failed'):
+                        job.finish(host, 'failed', item)
+                    elif item.get('finished'):
+                        job.finish(host, 'success', item)
+
+            # ansible 在任务超时时会结束 job，多等两个轮询间隔后仍未完成的主机不再等待
+            now = time.time()
+            for job in jobs:
+                if job.jids and now > job.deadline + interval * 2:
+                    for host, jid in list(job.jids.items()):
+                        job.finish(host, 'failed', {'ansible_job_id': jid, 'failed': True,
+                                                    'msg': f'async job not finished in {job.timeout}s'})
+
+    def run_tasks(self, hosts='localhost', tasks=None, gether_facts="no"):
+        """
+        将任务列表放在同一个 play 中执行，只创建一次 TaskQueueManager，
+        每个任务的结果通过 get_task_result 按顺序获取
+        参数说明：
+        tasks -- 任务列表，按顺序执行
+        """
+        play_source = dict(
+            name="Ad-hoc",
+            hosts=hosts,
+            gather_facts=gether_facts,
+            strategy=self.strategy,
+            tasks=tasks if tasks else [dict(action=dict(module='ping', args=''))]
+        )
+
+        self._run_play(play_source)
+
+    def _run_play(self, play_source):
         play = Play().load(play_source, variable_manager=self.variable_manager, loader=self.loader)
 
+        tqm = self._session_tqm()
+        if tqm is not None:
+            tqm.reset()
+            tqm.run(play)
+            return
+
         tqm = TaskQueueManager(
             inventory=self.inv_obj,
             variable_manager=self.variable_manager,
             loader=self.loader,
             passwords=self.passwords,
-            stdout_callback=self.results_callback
+            stdout_callback=self.results_callback,
+            forks=self.forks
         )
 
         try:
             result = tqm.run(play)
         finally:
             tqm.cleanup()
-            if self.loader:
-                self.loader.cleanup_all_tmp_files()
-            shutil.rmtree(C.DEFAULT_LOCAL_TMP, True)
+            self._cleanup_local_tmp()
 
     def playbook(self, playbooks):
         """
@@ -145,29 +472,27 @@ class MyAnsible(object):
                                     passwords=self.passwords
                                     )
 
-        # 使用回调函数
-        playbook._tqm._stdout_callback = self.results_callback
+        # 使用回调函数，开启会话时替换为会话内的 TaskQueueManager
+        tqm = self._session_tqm()
+        if tqm is not None:
+            playbook._tqm.cleanup()
+            playbook._tqm = tqm
+            tqm.reset()
+        else:
+            playbook._tqm._stdout_callback = self.results_callback
 
         result = playbook.run()
 
     def get_result(self):
-        result_raw = {}
-
-        for host, result in self.results_callback.host_ok.items():
-            result._result['ansible_run_status'] = 'success'
-            result._result['host'] = host
-            result_raw[host] = result._result
-        for host, result in self.results_callback.host_failed.items():
-            result._result['ansible_run_status'] = 'failed'
-            result._result['host'] = host
-            result_raw[host] = result._result
-        for host, result in self.results_callback.host_unreachable.items():
-            result._result['ansible_run_status'] = 'unreachable'
-            result._result['host'] = host
-            result_raw[host] = result._result
-
-        # 最终打印结果，并且使用 JSON 继续格式化
-        # print(json.dumps(result_raw, indent=4))
-
+        """
+        返回上一次取结果之后所有执行的结果，同一台主机的多个结果通过 ResultStore.latest 取最后一条
+        """
+        results = self.results_callback.results
         self.results_callback.cleanup()
-        return json.dumps(result_raw)
+        return results
+
+    def get_task_result(self):
+        """
+        返回任务列表的执行结果，按任务顺序记录每台主机的结果
+        """
+        return self.get_result()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import json
+import tempfile
+from app.commom import file_checksum
+from app.result import PROBE_VARS
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+
+class ChecksumIndex(object):
+    """
+    本地文件校验值索引，按路径、大小和修改时间缓存，文件未变化时不重复计算
+    """
+    def __init__(self, path=None):
+        self.path = path if path else os.path.join(basedir, 'packages/.checksum_index.json')
+        self._index = None
+
+    def _load(self):
+        if self._index is None:
+            try:
+                with open(self.path) as file:
+                    self._index = json.load(file)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def save(self):
+        # 先写临时文件再替换，避免并发执行的任务读到写了一半的索引
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.checksum_index_')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self._load(), file, indent=2)
+        os.replace(temp, self.path)
+
+    def get(self, src):
+        """
+        返回文件的 sha256 校验值
+        """
+        index = self._load()
+        stat = os.stat(src)
+        key = os.path.relpath(os.path.abspath(src), basedir)
+
+        entry = index.get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['sha256']
+
+        sha256 = file_checksum(src)
+        index[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+        self.save()
+        return sha256
+
+
+checksum_index = ChecksumIndex()
+
+
+def checksum_probe(src_list, dest):
+    """
+    生成校验探测脚本，只对大小一致的文件计算 sha256，输出 sha256sum 格式的结果
+    """
+    probe = ' '.join(f'[ $(stat -c %s {os.path.basename(src)} 2>/dev/null || echo -1) -eq {os.path.getsize(src)} ] '
+                     f'&& sha256sum {os.path.basename(src)};' for src in src_list)
+    return f'cd {dest} 2>/dev/null || exit 0; {probe} true'
+
+
+def probe_missing_files(src_list, stdout):
+    """
+    按校验探测的输出返回需要分发的文件列表
+    """
+    remote = {}
+    for line in stdout.splitlines():
+        sha256, _, name = line.partition('  ')
+        remote[name] = sha256
+
+    return [src for src in src_list if remote.get(os.path.basename(src)) != checksum_index.get(src)]
+
+
+def remote_missing_files(myansible, hosts, src_list, dest):
+    """
+    每台主机执行一次校验探测，只对大小一致的文件计算 sha256
+    :param src_list: 控制节点上的文件列表
+    :param dest: 远程目录
+    :return: 主机和需要分发的文件列表的字典，文件缺失、不完整或校验不一致都需要分发
+    """
+    task = dict(action=dict(module='shell', args=checksum_probe(src_list, dest)), vars=PROBE_VARS)
+    myansible.run_tasks(hosts=hosts, tasks=[task])
+
+    missing = {host.get_name(): list(src_list) for host in myansible.inv_obj.get_hosts(pattern=hosts)}
+    for host, _, result in myansible.get_task_result().select(status='success'):
+        missing[host] = probe_missing_files(src_list, result['stdout'])
+
+    return missing
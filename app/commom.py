@@ -4,30 +4,36 @@
 
 import subprocess
 import os
+import hashlib
 from app.config import config
 from string import Template
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
 
-def run_shell_command(command):
-    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
+def run_shell_command(command, timeout=None):
+    result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8",
+                            timeout=timeout)
     return result
 
 
-def set_config_by_ansible(myansible):
+def file_checksum(path, algorithm='sha256'):
     """
-    加载 ansible 变量到 config
+    计算本地文件的校验值
     """
-    all_hosts = myansible.inv_obj.get_groups_dict()['all']
+    file_hash = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
-    hostname = []
-    for ip in all_hosts:
-        host = myansible.inv_obj.get_host(hostname=ip)
-        host_vars = myansible.variable_manager.get_vars(host=host)
-        hostname.append({'ip': ip, 'name': host_vars.get('hostname')})
 
-    config['host'] = hostname
+def set_config_by_ansible(myansible):
+    """
+    加载 ansible 变量到 config
+    """
+    index = myansible.index
+    config['host'] = [{'ip': ip, 'name': index.hostname(ip)} for ip in index.group('all')]
 
 
 def set_ansible_by_config(myansible):
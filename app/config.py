@@ -9,3 +9,10 @@ basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
 with open(os.path.join(basedir, 'conf/config.yml')) as file:
     config = yaml.load(file, Loader=yaml.FullLoader)
+
+
+def project_path(path):
+    """
+    配置中的相对路径相对于项目目录，与执行时的当前目录无关，null 即不使用
+    """
+    return os.path.join(basedir, path) if path else path
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import sys
+import contextlib
+from app.ansible_api import MyAnsible
+from app.log import check_log, install_log, ProgressLog
+from app.ssh_without_pass import SSHWithoutPass
+from app.commom import set_config_by_ansible, set_ansible_by_config
+from app.config import config, project_path
+from app.task import BaseTemple, ScmServerTemple, ScmAgentTemple, DBTemple, HATemple, disable_requiretty_task, \
+    restore_requiretty_task
+from app.scheduler import TaskGraph
+from app.mirror import PackageMirror, detect_address, mirror_enabled
+from app.yumrepo import build_yum_repo
+from app.report import event_offset, read_events, timing_report
+from app.journal import InstallJournal
+from app.preflight import preflight_check, format_table
+from app.plan import install_plan, measure_throughput, estimate_duration, format_plan
+
+
+def servers_check(myansible, hosts, max_fail_percent=0):
+    """
+    安装前检查服务器：ssh 连通、sudo、yum 源、控制节点 http 服务、磁盘空间和时钟偏差，
+    在分发安装包之前发现问题
+    :param myansible: ansible 实例
+    :param hosts:：主机组标签
+    :param max_fail_percent: 允许检查失败的主机比例，未超过时跳过失败的主机继续执行
+    """
+    rows, failed = preflight_check(myansible, hosts)
+    check_log.info('preflight check result:\n' + format_table(rows))
+
+    if failed:
+        check_log.error(f'{failed} preflight check failed')
+
+    if len(failed) * 100 > len(rows) * max_fail_percent:
+        check_log.error('server check failed,the program will exit.')
+        sys.exit(1)
+    if failed:
+        myansible.failed_hosts.update(failed)
+        check_log.warning(f'{failed} will be skipped.')
+    check_log.info('server check ok.')
+
+
+class CdhInstall(object):
+    def __init__(self, password, resume=False):
+        self.password = password
+        # 安装记录，resume 时跳过输入未变化且已完成的阶段
+        self.journal = InstallJournal(project_path(config['journal']['path']))
+        self.resume = resume
+        self.port = config['ssh']['port']
+        self.user = config['ssh']['user']
+
+        forks = config['ssh']['forks']
+        strategy = config['strategy']
+        event_log = project_path(config['event_log']['path'])
+        result = config['result']
+        failure_dir = project_path(result['failure_dir'])
+        if self.user != 'root':
+            self.myansible = MyAnsible(inventory='conf/hosts', remote_user=self.user, forks=forks, strategy=strategy,
+                                       event_log=event_log, max_output=result['max_output'],
+                                       failure_dir=failure_dir,
+                                       become=True, become_method='sudo', become_user='root')
+            self.myansible.variable_manager.extra_vars.update({'ansible_become_password': self.password})
+        else:
+            self.myansible = MyAnsible(inventory='conf/hosts', remote_user=self.user, forks=forks, strategy=strategy,
+                                       event_log=event_log, max_output=result['max_output'],
+                                       failure_dir=failure_dir)
+
+        # 长时间执行的任务（如 yum 安装、parcels 分发）定期输出完成进度
+        self.myansible.subscribe(ProgressLog(install_log, interval=config['event_log']['progress_interval']))
+
+        self.__set_config()
+
+    def _ssh_distribute(self, hosts: list):
+        swp = SSHWithoutPass()
+        return swp.distribute_ssh_key(hosts=hosts, user=self.user, password=self.password, port=self.port,
+                                      workers=config['ssh']['workers'], timeout=config['ssh']['timeout'])
+
+    @contextlib.contextmanager
+    def _connection_profile(self, hosts, read_only=False):
+        """
+        使用配置的连接配置，performance 配置开启 pipelining，非 root 用户需要先关闭 sudo 的 requiretty，
+        执行结束（包括异常退出）时恢复 requiretty
+        :param read_only: 不修改主机，非 root 用户不关闭 requiretty，改为不使用 pipelining
+        """
+        profile = config['ssh']['profile']
+        sudoers = profile == 'performance' and self.user != 'root'
+        if sudoers and not read_only:
+            disable_requiretty_task(self.myansible, hosts, self.user)
+        self.myansible.set_connection_profile(profile)
+        if sudoers and read_only:
+            self.myansible.variable_manager.extra_vars.update({'ansible_pipelining': False})
+            sudoers = False
+        try:
+            yield
+        finally:
+            if sudoers:
+                restore_requiretty_task(self.myansible, hosts, self.user)
+
+    def _package_mirror(self):
+        """
+        需要时返回控制节点的 http 文件服务，否则返回空的上下文
+        """
+        distribute = config['distribute']
+        if not mirror_enabled():
+            return contextlib.ExitStack()
+
+        if distribute['mirror_host'] is None:
+            host = self.myansible.index.group('all')[0]
+            distribute['mirror_host'] = detect_address(self.myansible.index.var(host, 'ansible_host', host))
+        return PackageMirror(distribute['mirror_host'], port=distribute['mirror_port'])
+
+    def __set_config(self):
+        set_config_by_ansible(self.myansible)
+        set_ansible_by_config(self.myansible)
+
+    def _build_yum_repo(self):
+        if config['yum_repo']['enable'] and not build_yum_repo():
+            install_log.error('build local yum repo failed, the program will exit.')
+            sys.exit(1)
+
+    def _run_graph(self, graph):
+        """
+        执行任务图，结束后输出最慢的阶段、任务、主机和关键路径
+        """
+        event_log = project_path(config['event_log']['path'])
+        offset = event_offset(event_log)
+        try:
+            graph.run()
+        finally:
+            self.journal.close()
+        install_log.info(timing_report(graph.nodes, read_events(event_log, offset)))
+
+    def install(self):
+        host_list = self.myansible.inv_obj.get_hosts()
+        self._ssh_distribute(host_list)
+        self._build_yum_repo()
+
+        # 整个安装过程复用同一个 ansible 执行上下文，结束时关闭
+        with self.myansible, self._package_mirror(), self._connection_profile('cdh_servers'):
+            servers_check(self.myansible, hosts='cdh_servers')
+            self._run_graph(self._install_graph())
+
+    def _install_graph(self):
+        """
+        按任务依赖关系生成执行图，互不依赖的任务并发执行
+        """
+        graph = TaskGraph(self.myansible, max_workers=config['parallel_stages'],
+                          journal=self.journal, resume=self.resume)
+
+        cdh_server = BaseTemple(self.myansible, hosts='cdh_servers')
+        cdh_server.plan(graph)
+
+        db_server = DBTemple(self.myansible, hosts='db_server')
+        db_server.plan(graph)
+
+        scm_server = ScmServerTemple(self.myansible, hosts='scm_server')
+        scm_server.plan(graph)
+
+        scm_agent = ScmAgentTemple(self.myansible, hosts='scm_agent')
+        scm_agent.plan(graph)
+
+        if config['ha']:
+            ha = HATemple(self.myansible, haproxy_hosts='haproxy_server')
+            ha.plan(graph)
+
+        return graph
+
+    def _plan_agent(self, graph, hosts, new_hosts):
+        base_init = BaseTemple(self.myansible, hosts=hosts, new_hosts=new_hosts)
+        base_init.plan(graph)
+
+        scm_agent = ScmAgentTemple(self.myansible, hosts=hosts)
+        scm_agent.plan(graph)
+
+    def add_agent(self, host_list: list):
+        """
+        添加agent节点，按 add_agent.wave_size 分批流水线执行，
+        失败主机比例超过 add_agent.max_fail_percent 时中止
+        :param host_list: 主机列表
+        """
+        max_fail_percent = config['add_agent']['max_fail_percent']
+        hosts = ','.join(host_list) + ','
+
+        self._ssh_distribute(host_list)
+        self._build_yum_repo()
+
+        with self.myansible, self._package_mirror(), self._connection_profile(hosts):
+            servers_check(self.myansible, hosts=hosts, max_fail_percent=max_fail_percent)
+
+            # 检查失败的主机不再分批，/etc/hosts 仍按所有新增主机计算映射差异
+            new_hosts = list(host_list)
+            host_list = [host for host in host_list if host not in self.myansible.failed_hosts]
+            self._run_graph(self._add_agent_graph(host_list, new_hosts))
+
+            if self.myansible.failed_hosts:
+                install_log.error(f'{sorted(self.myansible.failed_hosts)} add agent failed.')
+
+    def _add_agent_graph(self, host_list, new_hosts):
+        wave_size = config['add_agent']['wave_size'] or len(new_hosts)
+        waves = [','.join(host_list[i:i + wave_size]) + ',' for i in range(0, len(host_list), wave_size)]
+
+        graph = TaskGraph(self.myansible, max_workers=config['parallel_stages'],
+                          max_fail_percent=config['add_agent']['max_fail_percent'],
+                          journal=self.journal, resume=self.resume, target_hosts=new_hosts)
+        graph.pipeline(waves, lambda wave: self._plan_agent(graph, wave, new_hosts))
+        return graph
+
+    def plan(self, host_list=None, measure=False):
+        """
+        只探测不安装：输出每台主机还需要执行的阶段数和分发的字节数，
+        以及按分发带宽和历史阶段耗时估算的安装时间，不修改主机
+        :param host_list: 添加 agent 的主机列表，为空时按完整安装生成计划
+        :param measure: 向每台主机复制测试文件测量分发带宽，测量结束后删除
+        """
+        # 与安装时使用相同的连接配置和 http 服务，探测和测速的结果与实际安装一致
+        hosts = ','.join(host_list) + ',' if host_list else 'cdh_servers'
+        with self.myansible, self._package_mirror(), self._connection_profile(hosts, read_only=True):
+            graph = self._add_agent_graph(host_list, host_list) if host_list else self._install_graph()
+            rows, node_bytes = install_plan(self.myansible, graph)
+
+            throughput = None
+            sample_hosts = [row['host'] for row in rows if row['bytes']]
+            if measure and sample_hosts and config['plan']['sample_mb']:
+                throughput = measure_throughput(self.myansible, ','.join(sample_hosts) + ',',
+                                                config['plan']['sample_mb'])
+
+            history = self.journal.stage_durations()
+            fanout = config['distribute']['fanout'] if config['distribute']['mode'] == 'relay' else 1
+            estimate = estimate_duration(graph.nodes, node_bytes, history, throughput, fanout)
+        self.journal.close()
+
+        print(format_plan(rows, node_bytes, history, throughput, estimate))
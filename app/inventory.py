@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+from collections import OrderedDict
+from ansible.inventory.helpers import get_group_vars, sort_groups
+from ansible.utils.vars import combine_vars
+from ansible.vars.plugins import get_vars_from_inventory_sources
+
+
+class InventoryIndex(object):
+    """
+    资产快照，会话开始时建立一次，按 ip、主机名和组查询主机和资产变量，
+    不再对每台主机调用 variable_manager.get_vars 解析所有变量来源
+    包含资产文件中的变量和资产目录下 group_vars、host_vars 中的变量，不受执行时排除主机的影响
+    """
+    def __init__(self, inv_obj, loader):
+        self._inv_obj = inv_obj
+        self._loader = loader
+        # 组名和 group_vars 文件中的变量，每个组只读取一次
+        self._group_files = {}
+        # 组名和组内主机列表，与 get_groups_dict 相同
+        self.groups = OrderedDict((name, list(hosts)) for name, hosts in inv_obj.get_groups_dict().items())
+        # 主机和资产变量
+        self.host_vars = OrderedDict()
+        # 主机名和主机
+        self.names = {}
+
+        for host in inv_obj.get_hosts():
+            host_vars = self._resolve(host)
+            self.host_vars[host.get_name()] = host_vars
+            if host_vars.get('hostname'):
+                self.names[host_vars['hostname']] = host.get_name()
+
+    def _file_vars(self, entity):
+        return get_vars_from_inventory_sources(self._loader, self._inv_obj._sources, [entity], 'task')
+
+    def _group_file_vars(self, group):
+        if group.name not in self._group_files:
+            self._group_files[group.name] = self._file_vars(group)
+        return self._group_files[group.name]
+
+    def _resolve(self, host):
+        """
+        按 variable_manager.get_vars 的优先级合并主机的资产变量：
+        all 组、其它组按层级、主机，每一级资产文件中的变量先于 group_vars、host_vars 中的变量
+        """
+        all_group = self._inv_obj.groups['all']
+        groups = sort_groups([group for group in host.get_groups() if group.name != 'all'])
+
+        host_vars = combine_vars(all_group.get_vars(), self._group_file_vars(all_group))
+        host_vars = combine_vars(host_vars, get_group_vars(groups))
+        for group in groups:
+            host_vars = combine_vars(host_vars, self._group_file_vars(group))
+        host_vars = combine_vars(host_vars, host.get_vars())
+        return combine_vars(host_vars, self._file_vars(host))
+
+    def group(self, name):
+        """
+        返回组内的主机列表，组不存在时返回空列表
+        """
+        return self.groups.get(name, [])
+
+    def hostname(self, host):
+        return self.host_vars.get(host, {}).get('hostname')
+
+    def host(self, hostname):
+        """
+        按主机名返回主机
+        """
+        return self.names.get(hostname)
+
+    def var(self, host, name, default=None):
+        return self.host_vars.get(host, {}).get(name, default)
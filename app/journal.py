@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import statistics
+from app.config import config
+from app.checksum import checksum_index
+from app.plan import stage_inputs
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# 只影响执行方式、不影响安装结果的配置，不计入输入校验值
+RUNTIME_KEYS = ('ssh', 'distribute', 'add_agent', 'event_log', 'journal', 'parallel_stages', 'strategy',
+                'async_job', 'preflight', 'plan', 'result')
+
+
+class InstallJournal(object):
+    """
+    本地安装记录，保存每台主机已完成的安装阶段和输入校验值，
+    --resume 时跳过输入未变化且已完成的阶段，不需要连接主机检查
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('create table if not exists completed ('
+                               'host text not null, stage text not null, input_hash text not null, '
+                               'finished real not null, primary key (host, stage))')
+            self._conn.execute('create table if not exists stage_timing ('
+                               'stage text not null, hosts integer not null, duration real not null, '
+                               'finished real not null)')
+        return self._conn
+
+    @staticmethod
+    def input_hash(func, args, kwargs):
+        """
+        计算阶段的输入校验值：任务函数、参数、影响安装结果的配置，以及阶段用到的安装包、脚本和模板的内容
+        资产中的主机列表不计入，添加主机不影响已有主机上已完成的阶段
+        """
+        settings = {key: value for key, value in config.items() if key not in RUNTIME_KEYS + ('host',)}
+        files = {os.path.relpath(src, basedir): checksum_index.get(src) if os.path.exists(src) else None
+                 for src in stage_inputs(func)}
+        source = json.dumps([func.__name__, args, kwargs, settings, files], sort_keys=True, default=str)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def finished(self, stage, input_hash, hosts):
+        """
+        返回 hosts 中已完成该阶段且输入未变化的主机集合
+        """
+        rows = self.conn.execute('select host from completed where stage = ? and input_hash = ?',
+                                 (stage, input_hash))
+        return {host for host, in rows} & set(hosts)
+
+    def record(self, stage, input_hash, hosts):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('insert or replace into completed (host, stage, input_hash, finished) '
+                                  'values (?, ?, ?, ?)', [(host, stage, input_hash, now) for host in hosts])
+
+    def record_timing(self, stage, hosts, duration):
+        """
+        记录阶段的执行耗时，用于 --plan 估算安装时间
+        """
+        with self.conn:
+            self.conn.execute('insert into stage_timing (stage, hosts, duration, finished) values (?, ?, ?, ?)',
+                              (stage, hosts, duration, time.time()))
+
+    def stage_durations(self):
+        """
+        返回每个阶段历史耗时的中位数（秒）
+        """
+        durations = {}
+        for stage, duration in self.conn.execute('select stage, duration from stage_timing'):
+            durations.setdefault(stage, []).append(duration)
+        return {stage: statistics.median(values) for stage, values in durations.items()}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -3,29 +3,40 @@
 # Author: Yujichang
 
 import os
+import time
 import logging
 import logging.handlers
+from collections import Counter
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
 
 class SystemLog(object):
     def __init__(self, logger):
-        self.logger = logging.getLogger(logger)
+        self.name = logger
+        self._logger = None
 
-        stream_handler = logging.StreamHandler()
-        file_handler = logging.FileHandler(filename=os.path.join(basedir, 'logs/install.log'))
+    @property
+    def logger(self):
+        # 第一次写日志时才创建处理器和打开日志文件，导入模块时不做文件操作
+        if self._logger is None:
+            logger = logging.getLogger(self.name)
 
-        self.logger.setLevel(logging.INFO)
-        stream_handler.setLevel(logging.INFO)
-        file_handler.setLevel(logging.INFO)
+            stream_handler = logging.StreamHandler()
+            file_handler = logging.FileHandler(filename=os.path.join(basedir, 'logs/install.log'))
 
-        formatter = logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
-        stream_handler.setFormatter(formatter)
-        file_handler.setFormatter(formatter)
+            logger.setLevel(logging.INFO)
+            stream_handler.setLevel(logging.INFO)
+            file_handler.setLevel(logging.INFO)
 
-        self.logger.addHandler(stream_handler)
-        self.logger.addHandler(file_handler)
+            formatter = logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+            stream_handler.setFormatter(formatter)
+            file_handler.setFormatter(formatter)
+
+            logger.addHandler(stream_handler)
+            logger.addHandler(file_handler)
+            self._logger = logger
+        return self._logger
 
     def info(self, msg):
         self.logger.info(msg)
@@ -40,6 +51,30 @@ class SystemLog(object):
         self.logger.critical(msg)
 
 
+class ProgressLog(object):
+    """
+    主机事件订阅函数，逐条累加当前任务各状态的主机数，每隔 interval 秒输出一次进度
+    """
+    def __init__(self, log, interval=10):
+        self.log = log
+        self.interval = interval
+        self.task = None
+        self.stats = Counter()
+        self._last = time.time()
+
+    def __call__(self, event):
+        if event['task_id'] != self.task:
+            self.task = event['task_id']
+            self.stats.clear()
+        self.stats[event['status']] += 1
+
+        now = time.time()
+        if now - self._last >= self.interval:
+            self._last = now
+            stats = ', '.join(f'{status} {count}' for status, count in sorted(self.stats.items()))
+            self.log.info(f'[{event["task"]}] {sum(self.stats.values())} hosts done: {stats}')
+
+
 check_log = SystemLog('checkLog')
 ssh_distribute_log = SystemLog('sshDistributeLog')
 install_log = SystemLog('installLog')
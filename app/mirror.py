@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import re
+import socket
+import threading
+import posixpath
+from urllib.parse import unquote
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from app.config import config
+from app.checksum import checksum_index
+from app.log import install_log as log
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# 只对外提供这些目录下的文件
+SERVE_DIRS = ('packages', 'scripts')
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    只读文件服务，支持 Range 请求，下载中断后可以从断点继续
+    """
+    def translate_path(self, path):
+        path = posixpath.normpath(unquote(path.split('?', 1)[0].split('#', 1)[0]))
+        parts = [part for part in path.split('/') if part and part not in ('.', '..')]
+        if not parts or parts[0] not in SERVE_DIRS:
+            return ''
+        return os.path.join(basedir, *parts)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return None
+
+        file = open(path, 'rb')
+        size = os.fstat(file.fileno()).st_size
+        start, end = 0, size - 1
+
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            end = min(end, size - 1)
+
+            if start > end:
+                file.close()
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return None
+
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        file.seek(start)
+        self.range_length = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        remaining = self.range_length
+        while remaining > 0:
+            chunk = source.read(min(1024 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def detect_address(remote_ip):
+    """
+    获取控制节点访问 remote_ip 时使用的本机地址，即其他主机访问控制节点的地址
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((remote_ip, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+def mirror_url():
+    distribute = config['distribute']
+    return f"http://{distribute['mirror_host']}:{distribute['mirror_port']}"
+
+
+def mirror_enabled():
+    """
+    http 分发、流式解压或本地yum源都需要控制节点的 http 服务
+    """
+    distribute = config['distribute']
+    return distribute['mode'] == 'http' or distribute['stream'] or config['yum_repo']['enable']
+
+
+class PackageMirror(object):
+    """
+    控制节点上的 http 文件服务，各主机从这里并行拉取 packages 和 scripts 目录下的文件，
+    只监听 mirror_url() 中各主机访问控制节点的地址，不在其他网卡上提供安装包
+    """
+    def __init__(self, host, port=18090):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), RangeRequestHandler)
+        threading.Thread(target=self._server.serve_forever, name='package-mirror', daemon=True).start()
+        log.info(f'package mirror started at {mirror_url()}.')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def mirror_download_task(src_list, dest):
+    """
+    生成从控制节点 http 服务拉取文件的任务，多个文件并行下载，中断后从断点续传，下载完成后校验 sha256
+    只下载主机变量 sync_files 中列出的文件
+    :param src_list: 控制节点上的文件列表，必须在 packages 或 scripts 目录下
+    """
+    download = []
+    verify = []
+    for src in src_list:
+        name = os.path.basename(src)
+        size = os.path.getsize(src)
+        url = f'{mirror_url()}/{os.path.relpath(os.path.abspath(src), basedir)}'
+        sha256 = checksum_index.get(src)
+
+        # 已经不小于目标大小但校验不一致的文件无法续传，需要删除后重新下载
+        download.append(f"{{% if '{name}' in sync_files %}}"
+                        f"( [ $(stat -c %s {name} 2>/dev/null || echo 0) -lt {size} ] || rm -f {name}; "
+                        f"curl -sSf --retry 3 --retry-delay 2 -C - -o {name} {url} ) & "
+                        f"{{% endif %}}")
+        verify.append(f"{{% if '{name}' in sync_files %}}"
+                      f"echo '{sha256}  {name}' | sha256sum -c --quiet - || exit 1; "
+                      f"{{% endif %}}")
+
+    script = f"cd {dest} || exit 1; {''.join(download)}wait; {''.join(verify)}true"
+    return dict(action=dict(module='shell', args=dict(cmd=script)), when='sync_files')
+
+
+def mirror_extract_task(src, dest, members=()):
+    """
+    生成边下载边解压的任务，压缩包不保存到主机，有 pigz 时多核解压
+    任务输出解压耗时（秒）和使用的解压程序
+    :param src: 控制节点上的 .tar.gz 文件，必须在 packages 目录下
+    :param dest: 远程解压目录
+    :param members: 可选，只解压匹配这些通配符的文件
+    """
+    wildcards = ' --wildcards ' + ' '.join(f"'{member}'" for member in members) if members else ''
+    url = f'{mirror_url()}/{os.path.relpath(os.path.abspath(src), basedir)}'
+    script = f'set -o pipefail; mkdir -p {dest}; ' \
+             f'if command -v pigz > /dev/null 2>&1; then decompress="pigz -dc"; else decompress="gzip -dc"; fi; ' \
+             f'start=$(date +%s.%N); ' \
+             f'curl -sSf --retry 3 {url} | $decompress | tar xf - -C {dest}{wildcards} || exit 1; ' \
+             f'echo "$(date +%s.%N) $start $decompress" | awk \'{{printf "%.3f %s\\n", $1 - $2, $3}}\''
+    return dict(action=dict(module='shell', args=dict(cmd=script, executable='/bin/bash')))
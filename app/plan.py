@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import time
+import tempfile
+from collections import OrderedDict
+from app.config import config
+from app.checksum import checksum_probe, probe_missing_files
+from app.result import PROBE_VARS
+from app.task import basedir, tempdir, parcel_staging, JDK_FILE, LOG4J_FILE, CDH_CM_FILE, MYSQL_FILE, CDH_PARCELS, \
+    distribute_file_task, install_mysql_task, install_scm_server_task, install_scm_agent_task, preseed_parcels_task, \
+    configure_yum_repo_task, install_jdk_task, install_ntp_task, init_mysql_task, unzip_scm_package_task, \
+    install_haproxy_task
+
+COLUMNS = ('host', 'stages', 'files', 'bytes')
+# 分发方式：copy 由控制节点直接复制，http 从控制节点的 http 服务拉取，relay 由已经收到文件的主机中继分发
+TRANSFER_PATHS = ('copy', 'http', 'relay')
+# 测量带宽时测试文件的远程目录，与安装临时目录分开，测量结束后整个删除
+SAMPLE_DIR = '/tmp/cdh_install_plan'
+
+
+def _package(name):
+    return os.path.join(basedir, f'packages/{name}')
+
+
+def _script(name):
+    return os.path.join(basedir, f'scripts/{name}')
+
+
+def _template(name):
+    return os.path.join(basedir, f'template/{name}')
+
+
+def stage_inputs(func):
+    """
+    返回阶段用到的控制节点文件：安装包、脚本和模板，不区分分发方式，
+    文件内容变化时安装记录中的输入校验值随之变化
+    """
+    inputs = {
+        configure_yum_repo_task: [_package(CDH_CM_FILE)],
+        distribute_file_task: [_package(CDH_CM_FILE), _package(JDK_FILE), _package(LOG4J_FILE),
+                               _script('installNTP.sh'), _script('installJDK.sh')],
+        install_jdk_task: [_package(JDK_FILE), _script('installJDK.sh')],
+        install_ntp_task: [_script('installNTP.sh')],
+        install_mysql_task: [_package(MYSQL_FILE), _script('installMysql.sh')],
+        init_mysql_task: [_template('initMysql.j2')],
+        unzip_scm_package_task: [_package(CDH_CM_FILE)],
+        install_scm_agent_task: [_package(CDH_CM_FILE), _package(LOG4J_FILE)],
+        install_scm_server_task: [_package(CDH_CM_FILE), _package(LOG4J_FILE), _package(CDH_PARCELS),
+                                  _template('db.properties.j2')],
+        preseed_parcels_task: [_package(CDH_PARCELS)],
+        install_haproxy_task: [_template('haproxy_cfg.j2')],
+    }
+    return inputs.get(func, [])
+
+
+def stage_files(func):
+    """
+    返回阶段分发到主机临时目录（parcels 包为暂存目录）的文件列表和流式解压的文件列表，与 app.task 中任务函数的分发方式一致，
+    流式解压的文件每次执行都会下载
+    """
+    stream = config['distribute']['stream']
+    cm_file = [] if config['yum_repo']['enable'] else [_package(CDH_CM_FILE)]
+
+    if func is distribute_file_task:
+        files = [_package(JDK_FILE)] if stream else cm_file + [_package(JDK_FILE), _package(LOG4J_FILE)]
+        return files + [_script('installNTP.sh'), _script('installJDK.sh')], []
+    if func is install_mysql_task:
+        return [_package(MYSQL_FILE), _script('installMysql.sh')], []
+    if func is install_scm_server_task:
+        # server 端同时安装 agent，log4j2 更新两次
+        if stream:
+            return [], cm_file + [_package(LOG4J_FILE), _package(CDH_PARCELS), _package(LOG4J_FILE)]
+        return [_package(CDH_PARCELS)], []
+    if func is install_scm_agent_task:
+        return [], cm_file + [_package(LOG4J_FILE)] if stream else []
+    if func is preseed_parcels_task:
+        return ([], [_package(CDH_PARCELS)]) if stream else ([_package(CDH_PARCELS)], [])
+    return [], []
+
+
+def transfer_path(func, src, streamed=False):
+    """
+    返回文件的分发方式，与 app.task 中任务函数的分发方式一致：流式解压的文件从 http 服务下载，
+    relay 模式下只有 distribute_file 和 preseed_parcels 的安装包中继分发，其余文件由控制节点复制
+    """
+    mode = config['distribute']['mode']
+    if streamed:
+        return 'http'
+    if mode == 'relay' and func in (distribute_file_task, preseed_parcels_task) and \
+            os.path.dirname(src) == os.path.join(basedir, 'packages'):
+        return 'relay'
+    return 'http' if mode == 'http' else 'copy'
+
+
+def probe_remote(myansible, hosts, src_list):
+    """
+    每台主机执行一次探测：临时目录和 parcels 暂存目录中已有的文件校验，以及 parcel 缓存目录是否已经预置
+    :return: 主机和需要分发的文件列表的字典，主机和是否已经预置 parcels 的字典
+    """
+    cache_dir = config['parcel_preseed']['dir']
+    parcels = [src for src in src_list if os.path.basename(src) == CDH_PARCELS]
+    others = [src for src in src_list if src not in parcels]
+    script = f'ls {cache_dir}/*.parcel > /dev/null 2>&1 && echo preseeded; ' \
+             f'( {checksum_probe(others, tempdir)} ); ( {checksum_probe(parcels, parcel_staging)} )'
+    myansible.run_tasks(hosts=hosts, tasks=[dict(action=dict(module='shell', args=script), vars=PROBE_VARS)])
+
+    missing = {host.get_name(): list(src_list) for host in myansible.inv_obj.get_hosts(pattern=hosts)}
+    preseeded = dict.fromkeys(missing, False)
+    for host, _, result in myansible.get_task_result().select(status='success'):
+        missing[host] = probe_missing_files(src_list, result['stdout'])
+        preseeded[host] = 'preseeded' in result['stdout'].splitlines()
+
+    return missing, preseeded
+
+
+def measure_throughput(myansible, hosts, sample_mb):
+    """
+    同时向所有主机复制 sample_mb 大小的测试文件，按总字节数和耗时计算控制节点的分发带宽，
+    扣除一个空任务的执行时间作为 ansible 本身的开销
+    会在主机上写入 SAMPLE_DIR 目录，只在 --plan --measure 时执行，结束（包括异常退出）时删除
+    :return: 带宽（字节/秒），测试失败时返回 None
+    """
+    fd, sample = tempfile.mkstemp(prefix='cdh_install_plan_')
+    dest = os.path.join(SAMPLE_DIR, os.path.basename(sample))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for _ in range(sample_mb):
+                file.write(os.urandom(1024 * 1024))
+
+        start = time.time()
+        task = dict(action=dict(module='file', args=f'path={SAMPLE_DIR} state=directory'))
+        myansible.run_tasks(hosts=hosts, tasks=[task])
+        myansible.get_task_result()
+        overhead = time.time() - start
+
+        start = time.time()
+        myansible.run_tasks(hosts=hosts, tasks=[dict(action=dict(module='copy', args=f'src={sample} dest={dest}'))])
+        results = myansible.get_task_result()
+        elapsed = time.time() - start - overhead
+    finally:
+        os.remove(sample)
+        task = dict(action=dict(module='file', args=f'path={SAMPLE_DIR} state=absent'))
+        myansible.run_tasks(hosts=hosts, tasks=[task])
+        myansible.get_task_result()
+
+    count = len(set(results.hosts()) - set(results.failed_hosts()))
+    if not count:
+        return None
+    return sample_mb * 1024 * 1024 * count / max(elapsed, 0.001)
+
+
+def install_plan(myansible, graph):
+    """
+    生成安装计划，只探测不执行安装任务：每台主机还需要执行的阶段数、分发的文件数和字节数
+    :param graph: 已添加任务的 TaskGraph，续装时按安装记录跳过已完成的阶段和主机
+    :return: 每台主机的计划列表，每个待执行阶段按分发方式统计的字节数
+    """
+    pending = graph.load_journal()
+    hosts = sorted(set().union(*(node.host_set - node.finished_hosts for node in pending)))
+
+    # 所有阶段分发到主机的文件一起探测，控制节点上不存在的安装包不计入
+    src_list = []
+    for node in pending:
+        for src in stage_files(node.func)[0]:
+            if src not in src_list and os.path.exists(src):
+                src_list.append(src)
+
+    missing, preseeded = {}, {}
+    if hosts:
+        missing, preseeded = probe_remote(myansible, ','.join(hosts) + ',', src_list)
+
+    rows = OrderedDict((host, {'host': host, 'stages': 0, 'files': 0, 'bytes': 0}) for host in hosts)
+    node_bytes = OrderedDict()
+    # 同一台主机上多个阶段用到的同一个文件只分发一次
+    sent = {host: set() for host in hosts}
+    for node in pending:
+        files, streamed = stage_files(node.func)
+        node_bytes[node] = dict.fromkeys(TRANSFER_PATHS, 0)
+        for host in sorted(node.host_set - node.finished_hosts):
+            row = rows[host]
+            row['stages'] += 1
+            if node.func is preseed_parcels_task and preseeded.get(host):
+                continue
+
+            need = [src for src in files if src in missing.get(host, ()) and src not in sent[host]]
+            sent[host].update(need)
+            need = [(src, False) for src in need] + [(src, True) for src in streamed if os.path.exists(src)]
+            for src, is_streamed in need:
+                size = os.path.getsize(src)
+                row['files'] += 1
+                row['bytes'] += size
+                node_bytes[node][transfer_path(node.func, src, is_streamed)] += size
+
+    return list(rows.values()), node_bytes
+
+
+def estimate_duration(nodes, node_bytes, history, throughput, fanout=1):
+    """
+    沿任务依赖估算总耗时：待执行的阶段取历史耗时和按带宽计算的传输耗时中较大的值，已完成的阶段不计耗时
+    copy 和 http 方式都由控制节点发出，中继分发的字节由多台主机同时发出，按 fanout 倍带宽计算
+    :param nodes: TaskGraph 的所有任务节点，前置任务在前
+    :param node_bytes: 待执行阶段按分发方式统计的字节数
+    :param history: 每个阶段的历史耗时（秒）
+    :param throughput: 控制节点的分发带宽（字节/秒）
+    :param fanout: 中继分发时每个来源主机每轮分发的主机数
+    """
+    finish = {}
+    for node in nodes:
+        duration = 0
+        if node in node_bytes:
+            size = node_bytes[node]
+            transfer = (size['copy'] + size['http'] + size['relay'] / fanout) / throughput if throughput else 0
+            duration = max(history.get(node.func.__name__, 0), transfer)
+        finish[node] = max([finish[dep] for dep in node.deps], default=0) + duration
+    return max(finish.values(), default=0)
+
+
+def _size(value):
+    for unit in ('B', 'K', 'M'):
+        if value < 1024:
+            return f'{value:.1f}{unit}' if unit != 'B' else f'{value}B'
+        value /= 1024
+    return f'{value:.1f}G'
+
+
+def format_plan(rows, node_bytes, history, throughput, estimate):
+    """
+    安装计划格式化为文本：每台主机一行，之后是汇总、带宽和估算耗时
+    """
+    table = [dict(row, stages=str(row['stages']), files=str(row['files']), bytes=_size(row['bytes'])) for row in rows]
+    widths = {column: max([len(column)] + [len(row[column]) for row in table]) for column in COLUMNS}
+    lines = ['  '.join(column.ljust(widths[column]) for column in COLUMNS).rstrip()]
+    for row in table:
+        lines.append('  '.join(row[column].ljust(widths[column]) for column in COLUMNS).rstrip())
+
+    paths = {path: sum(size[path] for size in node_bytes.values()) for path in TRANSFER_PATHS}
+    lines.append(f"total: {len(rows)} hosts, {sum(row['stages'] for row in rows)} stages, "
+                 f"{sum(row['files'] for row in rows)} files, {_size(sum(paths.values()))}")
+
+    distribute = config['distribute']
+    mode = distribute['mode'] + (f" (fanout {distribute['fanout']})" if distribute['mode'] == 'relay' else '')
+    if distribute['stream']:
+        mode += ', stream'
+    lines.append(f'distribute mode: {mode}; ' + ', '.join(f'{path} {_size(size)}' for path, size in paths.items()))
+    lines.append(f'throughput: {_size(throughput) + "/s" if throughput else "not measured"}')
+    lines.append(f'estimated duration: {estimate / 60:.1f}min')
+
+    no_history = sorted({node.func.__name__ for node in node_bytes if node.func.__name__ not in history})
+    if no_history:
+        lines.append(f'stages without history (transfer time only): {", ".join(no_history)}')
+    return '\n'.join(lines)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+from app.config import config
+from app.mirror import mirror_enabled, mirror_url
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+tempdir = '/tmp/cdh_install_temp'
+parcel_dir = '/opt/cloudera'
+
+COLUMNS = ('host', 'ssh', 'sudo', 'repo', 'mirror', 'tmp_free', 'opt_free', 'skew', 'result')
+
+
+def _package_size(name):
+    path = os.path.join(basedir, f'packages/{name}')
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def required_space(groups):
+    """
+    按主机所在的组返回临时目录和 /opt/cloudera 需要的空间（KB）：所有主机分发 jdk、log4j 和 cloudera manager 安装包，
+    db_server 还有 mysql 安装包，scm_server 还有解压到 parcel-repo 的 parcel，
+    开启预置时每台主机（都安装 agent）还有 parcel 缓存；parcels 压缩包暂存在 /opt/cloudera 所在的文件系统，
+    流式解压的压缩包不保存到主机
+    """
+    packages = config['packages']
+    stream = config['distribute']['stream']
+    server = 'scm_server' in groups
+    preseed = config['parcel_preseed']['enable']
+
+    tmp_files = {packages['jdk']}
+    if not stream:
+        tmp_files.add(packages['log4j'])
+        if not config['yum_repo']['enable']:
+            tmp_files.add(packages['cdh-cm'])
+    if 'db_server' in groups:
+        tmp_files.add(packages['mysql'])
+
+    tmp_size = sum(_package_size(name) for name in tmp_files)
+    opt_size = _package_size(packages['cdh-parcels']) * (int(server) + int(preseed))
+    if not stream and (server or preseed):
+        opt_size += _package_size(packages['cdh-parcels'])
+    return tmp_size // 1024, opt_size // 1024
+
+
+def probe_script(timeout):
+    """
+    生成检查脚本，每项检查都有超时，输出 key=value 格式的结果
+    """
+    # 使用控制节点的本地yum源时，检查前还没有配置该源，主机自带的源可能无法访问，只检查本地源的元数据
+    if config['yum_repo']['enable']:
+        repo = f'timeout {timeout} curl -sf -o /dev/null {mirror_url()}/packages/repo/repodata/repomd.xml'
+    else:
+        repo = f'timeout {timeout} yum -q makecache fast > /dev/null 2>&1'
+
+    mirror = ''
+    if mirror_enabled():
+        mirror = f'if timeout {timeout} curl -sfI -o /dev/null {mirror_url()}/packages/{config["packages"]["jdk"]}; ' \
+                 f'then echo mirror=ok; else echo mirror=fail; fi; '
+
+    # 时间最先输出，与执行窗口的开始时间比较，避免其他检查的耗时计入时钟偏差
+    return f'echo "epoch=$(date +%s.%N)"; ' \
+           f'free() {{ p=$1; while [ ! -e "$p" ]; do p=$(dirname "$p"); done; ' \
+           f'timeout {timeout} df -Pk "$p" | awk \'NR==2 {{print $4}}\'; }}; ' \
+           f'used() {{ timeout {timeout} du -sck "$@" 2>/dev/null | tail -n 1 | cut -f 1; }}; ' \
+           f'echo "uid=$(id -u)"; ' \
+           f'if {repo}; then echo repo=ok; else echo repo=fail; fi; ' \
+           f'{mirror}' \
+           f'echo "tmp_free=$(free {tempdir})"; echo "tmp_used=$(used {tempdir})"; ' \
+           f'echo "opt_free=$(free {parcel_dir})"; ' \
+           f'echo "opt_used=$(used {parcel_dir}/parcel-repo {config["parcel_preseed"]["dir"]} ' \
+           f'{config["parcel_staging"]})"'
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def preflight_check(myansible, hosts):
+    """
+    所有主机一次执行全部检查：ssh 连通、sudo、yum 源元数据、控制节点 http 服务、
+    临时目录和 /opt/cloudera 剩余空间、时钟偏差
+    :return: 每台主机的检查结果列表，失败的主机列表
+    """
+    timeout = config['preflight']['timeout']
+    max_clock_skew = config['preflight']['max_clock_skew']
+
+    # 按主机事件记录检查开始和结束时间，用于判断远程时钟是否在这个时间窗口内
+    window = {}
+
+    def record_window(event):
+        window[event['host']] = (event['time'] - event['duration'], event['time'])
+
+    task = dict(action=dict(module='shell', args=dict(cmd=probe_script(timeout), executable='/bin/bash')),
+                timeout=timeout * 4, vars=dict(ansible_timeout=timeout))
+
+    myansible.subscribe(record_window)
+    try:
+        myansible.run_tasks(hosts=hosts, tasks=[task])
+        results = myansible.get_task_result()
+    finally:
+        myansible.results_callback.subscribers.remove(record_window)
+
+    rows = []
+    failed = []
+    for host in results.hosts():
+        _, status, result = results.latest(host)
+        row = dict.fromkeys(COLUMNS, '-')
+        row['host'] = host
+
+        if status == 'unreachable':
+            row['ssh'] = 'fail'
+        elif status == 'failed' and 'stdout' not in result:
+            # 没有执行到脚本：sudo 失败或执行超时
+            row['ssh'] = 'ok'
+            message = str(result.get('msg', '')).lower()
+            if 'sudo' in message or 'become' in message or 'password' in message:
+                row['sudo'] = 'fail'
+        else:
+            values = dict(line.split('=', 1) for line in result.get('stdout', '').splitlines() if '=' in line)
+            row['ssh'] = 'ok'
+            row['sudo'] = 'ok' if values.get('uid') == '0' else 'fail'
+            row['repo'] = values.get('repo', 'fail')
+            row['mirror'] = values.get('mirror', '-')
+
+            # 已经分发的文件不再需要空间
+            groups = [name for name, members in myansible.index.groups.items() if host in members]
+            tmp_required, opt_required = required_space(groups)
+            tmp_free = _number(values.get('tmp_free'))
+            opt_free = _number(values.get('opt_free'))
+            tmp_need = max(tmp_required - (_number(values.get('tmp_used')) or 0), 0)
+            opt_need = max(opt_required - (_number(values.get('opt_used')) or 0), 0)
+            row['tmp_free'] = f'{tmp_free / 1024 / 1024:.1f}G' if tmp_free is not None else 'fail'
+            row['opt_free'] = f'{opt_free / 1024 / 1024:.1f}G' if opt_free is not None else 'fail'
+            if tmp_free is None or tmp_free < tmp_need:
+                row['tmp_free'] += '<' + f'{tmp_need / 1024 / 1024:.1f}G'
+            if opt_free is None or opt_free < opt_need:
+                row['opt_free'] += '<' + f'{opt_need / 1024 / 1024:.1f}G'
+
+            epoch = _number(values.get('epoch'))
+            start, end = window.get(host, (None, None))
+            if epoch is not None and start is not None:
+                skew = max(start - epoch, epoch - end, 0)
+                row['skew'] = f'{skew:.1f}s' + (f'>{max_clock_skew}s' if skew > max_clock_skew else '')
+
+        if any(value == 'fail' or '<' in value or '>' in value for value in row.values()) or status != 'success':
+            row['result'] = 'fail'
+            failed.append(host)
+        else:
+            row['result'] = 'ok'
+        rows.append(row)
+
+    return rows, failed
+
+
+def format_table(rows):
+    """
+    检查结果格式化为表格，每行一台主机
+    """
+    widths = {column: max([len(column)] + [len(row[column]) for row in rows]) for column in COLUMNS}
+    lines = ['  '.join(column.ljust(widths[column]) for column in COLUMNS).rstrip()]
+    for row in rows:
+        lines.append('  '.join(row[column].ljust(widths[column]) for column in COLUMNS).rstrip())
+    return '\n'.join(lines)
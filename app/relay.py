@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+from app.checksum import checksum_index
+from app.log import install_log as log
+
+
+def relay_plan(sources, targets, fanout):
+    """
+    为一轮分发分配文件来源，每个来源最多分发给 fanout 台主机
+    :param sources: 已经有文件的主机列表
+    :param targets: 还没有文件的主机列表
+    :return: 目标主机和来源主机的字典
+    """
+    plan = {}
+    targets = list(targets)
+    for source in sources:
+        for _ in range(fanout):
+            if not targets:
+                return plan
+            plan[targets.pop(0)] = source
+    return plan
+
+
+def _host_address(myansible, host_name):
+    # 其他主机访问该主机使用的地址，本地替身主机可在资产中配置 relay_address
+    index = myansible.index
+    return index.var(host_name, 'relay_address', index.var(host_name, 'ansible_host', host_name))
+
+
+def _host_port(myansible, host_name, port):
+    return myansible.index.var(host_name, 'relay_port', port)
+
+
+def _failed_hosts(myansible):
+    return set(myansible.get_task_result().failed_hosts())
+
+
+def _start_server(myansible, hosts, dest, names, port):
+    """
+    在来源主机上启动临时 http 服务，只监听其他主机访问该主机的地址，
+    服务目录 .relay 下只有指向中继文件的软链接，分发目录中的其他文件（如含密码的 initMysql.sql）不对外提供
+    """
+    for host in hosts:
+        myansible.variable_manager.set_host_variable(host, 'relay_port', _host_port(myansible, host, port))
+        myansible.variable_manager.set_host_variable(host, 'relay_bind', _host_address(myansible, host))
+
+    links = ' && '.join(f'ln -sfn {dest}/{name} .relay/{name}' for name in names)
+    python2 = 'python -c "import BaseHTTPServer as b, SimpleHTTPServer as s; ' \
+              'b.HTTPServer((\'{{ relay_bind }}\', {{ relay_port }}), s.SimpleHTTPRequestHandler).serve_forever()"'
+    python3 = 'python3 -m http.server --bind {{ relay_bind }} {{ relay_port }}'
+    background = '> /dev/null 2>&1 < /dev/null &'
+    command = f'cd {dest} && rm -rf .relay && mkdir .relay && {links} && cd .relay && ' \
+              f'if command -v python3 > /dev/null; then setsid nohup {python3} {background} ' \
+              f'else setsid nohup {python2} {background} fi; echo $! > {dest}/.relay.pid'
+    myansible.run_tasks(hosts=','.join(hosts) + ',',
+                        tasks=[dict(action=dict(module='shell', args=dict(cmd=command, executable='/bin/bash')))])
+    return _failed_hosts(myansible)
+
+
+def _stop_server(myansible, hosts, dest):
+    command = f'chdir={dest} [ -f .relay.pid ] && kill $(cat .relay.pid); rm -rf .relay.pid .relay'
+    myansible.run_tasks(hosts=','.join(hosts) + ',', tasks=[dict(action=dict(module='shell', args=command))])
+    myansible.get_task_result()
+
+
+def relay_files(myansible, hosts, src_list, dest, fanout=3, port=18080):
+    """
+    中继分发大文件：控制节点只分发给 fanout 台主机，之后每一轮由已校验文件的主机
+    通过临时 http 服务分发给下一批主机，总耗时随主机数按对数增长
+    :param hosts: 主机标签组
+    :param src_list: 控制节点上的文件列表
+    :param dest: 远程目录，可以使用 {{ inventory_hostname }} 等变量
+    :return: 分发失败的主机集合，由调用方回退到控制节点直接分发
+    """
+    targets = [host.get_name() for host in myansible.inv_obj.get_hosts(pattern=hosts)]
+    if not targets:
+        return set()
+
+    checksum = {os.path.basename(src): checksum_index.get(src) for src in src_list}
+    get_url_list = [dict(action=dict(module='get_url',
+                                     args=f'url={{{{ relay_url }}}}/{name} dest={dest}/{name} '
+                                          f'checksum=sha256:{sha256} timeout=60'),
+                         register='relay_result', until='relay_result is succeeded', retries=3, delay=2)
+                    for name, sha256 in checksum.items()]
+
+    # 第一轮由控制节点分发，来源主机上的文件必须与控制节点一致，因此按校验值覆盖
+    seeds = targets[:fanout]
+    task_list = [dict(action=dict(module='file', args=f'path={dest} state=directory'))]
+    for src in src_list:
+        name = os.path.basename(src)
+        task_list.append(dict(action=dict(module='copy', args=f'src={src} dest={dest}/{name}')))
+    myansible.run_tasks(hosts=','.join(seeds) + ',', tasks=task_list)
+    failed = _failed_hosts(myansible)
+
+    sources = [host for host in seeds if host not in failed]
+    targets = [host for host in targets if host not in seeds]
+    serving = []
+    wave = 1
+
+    try:
+        while sources and targets:
+            new_sources = [host for host in sources if host not in serving]
+            if new_sources:
+                bad_sources = _start_server(myansible, new_sources, dest, list(checksum), port)
+                serving.extend(new_sources)
+                sources = [host for host in sources if host not in bad_sources]
+
+            plan = relay_plan(sources, targets, fanout)
+            if not plan:
+                break
+            log.info(f'relay wave {wave}: {len(sources)} sources -> {len(plan)} hosts.')
+
+            for target, source in plan.items():
+                address = _host_address(myansible, source)
+                relay_url = f'http://{address}:{_host_port(myansible, source, port)}'
+                myansible.variable_manager.set_host_variable(target, 'relay_url', relay_url)
+
+            task_list = [dict(action=dict(module='file', args=f'path={dest} state=directory'))] + get_url_list
+            myansible.run_tasks(hosts=','.join(plan) + ',', tasks=task_list)
+            wave_failed = _failed_hosts(myansible)
+
+            failed.update(wave_failed)
+            sources.extend(host for host in plan if host not in wave_failed)
+            targets = [host for host in targets if host not in plan]
+            wave += 1
+    finally:
+        if serving:
+            _stop_server(myansible, serving, dest)
+
+    failed.update(targets)
+    return failed
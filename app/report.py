@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import json
+import statistics
+from collections import defaultdict, OrderedDict
+
+
+def event_offset(path):
+    """
+    返回事件日志当前大小，执行结束后从这个位置读取本次执行的事件
+    """
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def read_events(path, offset=0):
+    events = []
+    if not path or not os.path.exists(path):
+        return events
+
+    with open(path) as file:
+        file.seek(offset)
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def critical_path(nodes):
+    """
+    从最后结束的任务开始，沿最后完成的前置任务向前回溯，得到决定总耗时的任务链
+    """
+    node_list = [node for node in nodes if node.end is not None]
+    if not node_list:
+        return []
+
+    node = max(node_list, key=lambda item: item.end)
+    path = [node]
+    while True:
+        deps = [dep for dep in node.deps if dep.end is not None]
+        if not deps:
+            break
+        node = max(deps, key=lambda item: item.end)
+        path.append(node)
+    return path[::-1]
+
+
+def _task_timing(events):
+    # 按阶段和任务汇总每台主机的开始、结束时间
+    tasks = OrderedDict()
+    for event in events:
+        if event['status'] == 'skipped':
+            continue
+        key = (event.get('stage', ''), event['task_id'])
+        task = tasks.setdefault(key, {'name': event['task'], 'stage': event.get('stage', ''), 'hosts': {}})
+        task['hosts'][event['host']] = (event['time'] - event['duration'], event['time'])
+    return tasks.values()
+
+
+def timing_report(nodes, events, top=10):
+    """
+    生成耗时报告：最慢的阶段、最慢的 ansible 任务、拖慢任务的主机和关键路径
+    :param nodes: TaskGraph 的任务节点
+    :param events: 主机事件列表
+    :return: 报告文本
+    """
+    lines = ['timing report:']
+
+    stages = sorted((node for node in nodes if node.end is not None), key=lambda node: node.start - node.end)
+    lines.append(f'slowest stages (top {top}):')
+    for node in stages[:top]:
+        lines.append(f'  {node.end - node.start:9.1f}s  {node.name} [{node.status}]')
+
+    # 单个任务的墙钟时间由最慢的主机决定，超过中位数两倍的主机记为拖慢任务的主机
+    task_list = []
+    straggler = defaultdict(float)
+    for task in _task_timing(events):
+        hosts = task['hosts']
+        durations = {host: end - start for host, (start, end) in hosts.items()}
+        median = statistics.median(durations.values())
+        wall = max(end for _, end in hosts.values()) - min(start for start, _ in hosts.values())
+        slowest = max(durations, key=durations.get)
+        task_list.append((wall, task, slowest, durations[slowest], median, len(hosts)))
+
+        for host, duration in durations.items():
+            if len(hosts) > 1 and duration > median * 2 and duration - median >= 1:
+                straggler[host] += duration - median
+
+    lines.append(f'slowest ansible tasks (top {top}):')
+    for wall, task, slowest, duration, median, count in sorted(task_list, key=lambda item: -item[0])[:top]:
+        lines.append(f'  {wall:9.1f}s  {task["stage"]} {task["name"]}: {count} hosts, median {median:.1f}s, '
+                     f'slowest {slowest} {duration:.1f}s')
+
+    lines.append(f'straggler hosts (time over task median, top {top}):')
+    for host, excess in sorted(straggler.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f'  {excess:9.1f}s  {host}')
+    if not straggler:
+        lines.append('  none')
+
+    path = critical_path(nodes)
+    if path:
+        lines.append(f'critical path ({path[-1].end - path[0].start:.1f}s):')
+        previous = None
+        for node in path:
+            # 前置任务完成后等待空闲进程的时间
+            wait = node.start - previous.end if previous is not None else 0
+            wait_info = f', waited {wait:.1f}s for a worker' if wait >= 1 else ''
+            lines.append(f'  {node.end - node.start:9.1f}s  {node.name}{wait_info}')
+            previous = node
+
+    return '\n'.join(lines)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+from collections import OrderedDict
+
+# 精简结果中保留的模块返回字段，stdout_lines、stderr_lines 等重复或用不到的字段不保留
+RESULT_KEYS = ('rc', 'changed', 'failed', 'skipped', 'unreachable', 'msg', 'stdout', 'stderr',
+               'ansible_job_id', 'started', 'finished', 'item')
+# 超过长度时截断的输出字段
+OUTPUT_KEYS = ('stdout', 'stderr', 'msg')
+# 探测任务的任务变量，如检查 parcel 缓存是否已经预置，失败是预期结果，不保存失败主机的完整输出
+PROBE_VARS = {'result_probe': True}
+
+
+def truncate_output(value, max_output):
+    """
+    超过 max_output 个字符的输出只保留开头和结尾各一半
+    """
+    if not isinstance(value, str) or len(value) <= max_output:
+        return value
+    half = max_output // 2
+    return f'{value[:half]}\n... {len(value) - half * 2} characters truncated ...\n{value[-half:]}'
+
+
+def compact_result(result, max_output=4096):
+    """
+    精简模块返回结果：只保留运行状态、返回码和截断后的输出，循环任务的每一项同样精简
+    :param result: 模块返回结果字典
+    :param max_output: stdout、stderr、msg 保留的最大字符数
+    """
+    compact = {key: result[key] for key in RESULT_KEYS if key in result}
+    for key in OUTPUT_KEYS:
+        if key in compact:
+            compact[key] = truncate_output(compact[key], max_output)
+    if isinstance(result.get('results'), list):
+        compact['results'] = [compact_result(item, max_output) if isinstance(item, dict) else item
+                              for item in result['results']]
+    return compact
+
+
+class ResultStore(object):
+    """
+    任务运行结果，按执行顺序原地追加每台主机的结果，支持按运行状态查询
+    运行状态：success、failed、unreachable
+    """
+    __slots__ = ('records', '_latest', '_failed')
+
+    def __init__(self):
+        # (主机, 运行状态, 精简后的模块返回结果) 列表
+        self.records = []
+        # 主机和该主机最后一条结果的位置
+        self._latest = OrderedDict()
+        # 运行失败的主机和第一次失败时的运行状态
+        self._failed = OrderedDict()
+
+    def add(self, host, status, result):
+        self._latest[host] = len(self.records)
+        self.records.append((host, status, result))
+        if status != 'success':
+            self._failed.setdefault(host, status)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def hosts(self):
+        """
+        返回有运行结果的主机列表
+        """
+        return list(self._latest)
+
+    def all_success(self):
+        return not self._failed
+
+    def failed_hosts(self, status=None):
+        """
+        返回运行失败的主机列表
+        :param status: 为空时返回所有未成功的主机，否则只返回第一次失败为该状态的主机
+        """
+        return [host for host, failed in self._failed.items() if status is None or failed == status]
+
+    def latest(self, host):
+        """
+        返回主机最后一条结果 (主机, 运行状态, 模块返回结果)
+        """
+        return self.records[self._latest[host]]
+
+    def select(self, status=None, hosts=None):
+        """
+        按运行状态和主机过滤结果
+        """
+        hosts = set(hosts) if hosts is not None else None
+        return [record for record in self.records
+                if (status is None or record[1] == status) and (hosts is None or record[0] in hosts)]
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import sys
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from app.log import install_log as log
+
+
+def requires(*stages, cluster=(), partial=True):
+    """
+    声明任务函数的前置任务
+    :param stages: 在同一批主机上必须先完成的任务函数
+    :param cluster: 不论在哪些主机上运行，都必须先完成的任务函数，如 scm server 依赖数据库
+    :param partial: 续装时部分主机已完成，能否只在未完成的主机上执行，如主从配置需要主库和从库一起执行
+    """
+    def decorator(func):
+        func.requires = stages
+        func.requires_cluster = cluster
+        func.partial = partial
+        return func
+    return decorator
+
+
+class TaskNode(object):
+    def __init__(self, func, hosts, host_set, args, kwargs):
+        self.func = func
+        self.hosts = hosts
+        self.host_set = host_set
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = []
+        # deps 中只约束执行顺序的前置任务，如同一任务函数的上一次执行，失败时不影响本任务
+        self.order_only = set()
+        # pending, running, success, failed, skipped
+        self.status = 'pending'
+        # 开始和结束时间，由主进程记录
+        self.start = None
+        self.end = None
+        # 安装记录中的输入校验值，以及续装时跳过的已完成主机
+        self.input_hash = None
+        self.finished_hosts = set()
+
+    @property
+    def name(self):
+        return f'{self.func.__name__}[{self.hosts}]'
+
+
+class TaskGraph(object):
+    """
+    任务依赖图，前置任务都完成的任务各自在子进程中并发执行
+    执行失败的主机不再参与后续任务，失败主机比例超过 max_fail_percent 时不再启动新的任务
+    任务的所有主机都失败时任务失败，依赖它的任务不再执行；cluster 前置任务有主机失败时依赖它的任务也不再执行
+    设置 journal 时记录每台主机完成的任务，resume 时跳过已完成的任务和主机
+    """
+    def __init__(self, myansible, max_workers=4, max_fail_percent=100, journal=None, resume=False,
+                 target_hosts=None):
+        """
+        :param target_hosts: 计算失败主机比例的主机集合，如添加 agent 时的新增主机，
+                             为空时使用所有任务的主机；已有主机上的任务失败不计入
+        """
+        self.myansible = myansible
+        self.max_workers = max_workers
+        self.max_fail_percent = max_fail_percent
+        self.journal = journal
+        self.resume = resume
+        self.target_hosts = set(target_hosts) if target_hosts is not None else None
+        self.nodes = []
+
+    def add(self, func, hosts, *args, **kwargs):
+        """
+        添加任务，按任务函数声明的前置任务，连接之前添加的任务
+        :param func: app.task 中的任务函数
+        :param hosts: 主机标签组，任务以 func(myansible, hosts, *args, **kwargs) 方式调用
+        """
+        # 资产中匹配不到主机时，以主机标签本身作为依赖判断依据
+        host_set = {host.get_name() for host in self.myansible.inv_obj.get_hosts(pattern=hosts)} or {hosts}
+        node = TaskNode(func, hosts, host_set, args, kwargs)
+
+        # 同一任务函数在有重叠的主机上按添加顺序执行，避免同时修改同一个文件，只约束顺序
+        stages = getattr(func, 'requires', ())
+        cluster = getattr(func, 'requires_cluster', ())
+        for prev in self.nodes:
+            if prev.func in cluster or (prev.func in stages and prev.host_set & host_set):
+                node.deps.append(prev)
+            elif prev.func is func and prev.host_set & host_set:
+                node.deps.append(prev)
+                node.order_only.add(prev)
+
+        self.nodes.append(node)
+        return node
+
+    def pipeline(self, waves, plan):
+        """
+        分批添加任务，每一批的第一个任务在上一批的第一个任务结束后开始，
+        其余任务与下一批流水线执行，上一批失败不影响下一批，由 max_fail_percent 决定是否中止
+        :param waves: 每一批的主机标签组
+        :param plan: 参数为主机标签组，向任务图添加一批任务的函数
+        """
+        head = None
+        for hosts in waves:
+            start = len(self.nodes)
+            plan(hosts)
+            if len(self.nodes) == start:
+                continue
+            if head is not None:
+                self.nodes[start].deps.append(head)
+                self.nodes[start].order_only.add(head)
+            head = self.nodes[start]
+
+    def _run_node(self, node, writer):
+        # 子进程中开启自己的 ansible 执行上下文并排除之前失败的主机，结束时将失败主机发送给主进程并关闭执行上下文
+        # 任务函数只记录失败主机不抛出异常，所有目标主机都失败时以非 0 退出码结束
+        try:
+            self.myansible.open()
+            self.myansible.results_callback.stage = node.name
+            exclude = self.myansible.failed_hosts | node.finished_hosts
+            if exclude:
+                self.myansible.inv_obj.subset(['all'] + [f'!{host}' for host in sorted(exclude)])
+            node.func(self.myansible, node.hosts, *node.args, **node.kwargs)
+        finally:
+            writer.send(self.myansible.failed_hosts)
+            writer.close()
+            self.myansible.close()
+
+        targets = node.host_set - node.finished_hosts
+        if targets and targets <= self.myansible.failed_hosts:
+            sys.exit(1)
+
+    def _blocked(self, node):
+        """
+        前置任务失败或跳过，或 cluster 前置任务有失败的主机时，任务不能执行
+        """
+        cluster = getattr(node.func, 'requires_cluster', ())
+        for dep in node.deps:
+            if dep in node.order_only:
+                continue
+            if dep.status in ('failed', 'skipped'):
+                return True
+            if dep.func in cluster and dep.host_set & self.myansible.failed_hosts:
+                return True
+        return False
+
+    @staticmethod
+    def _ready(node):
+        # 只约束顺序的前置任务结束即可，其余前置任务必须成功
+        return all(dep.status == 'success' or (dep in node.order_only and dep.status in ('failed', 'skipped'))
+                   for dep in node.deps)
+
+    def _start(self, ctx, node):
+        log.info(f'start stage: {node.name}')
+        reader, writer = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=self._run_node, args=(node, writer), name=node.name)
+        process.start()
+        writer.close()
+        node.status = 'running'
+        node.start = time.time()
+        return reader, process
+
+    def _load_journal(self, node):
+        # 计算输入校验值，续装时查询已完成的主机，全部完成的任务不再执行
+        node.input_hash = self.journal.input_hash(node.func, node.args, node.kwargs)
+        if not self.resume:
+            return False
+
+        finished = self.journal.finished(node.func.__name__, node.input_hash, node.host_set)
+        if finished >= node.host_set:
+            node.status = 'success'
+            log.info(f'skip finished stage: {node.name}')
+            return True
+        if getattr(node.func, 'partial', True):
+            node.finished_hosts = finished
+        return False
+
+    def load_journal(self):
+        """
+        计算每个任务的输入校验值，续装时标记已完成的任务和主机
+        :return: 还需要执行的任务列表
+        """
+        if self.journal is None:
+            return list(self.nodes)
+        return [node for node in self.nodes if not self._load_journal(node)]
+
+    def _record_journal(self, node):
+        hosts = node.host_set - self.myansible.failed_hosts - node.finished_hosts
+        self.journal.record(node.func.__name__, node.input_hash, hosts)
+        self.journal.record_timing(node.func.__name__, len(hosts), node.end - node.start)
+
+    def _over_budget(self, total):
+        failed = len(self.myansible.failed_hosts & total)
+        return failed * 100 > len(total) * self.max_fail_percent
+
+    def run(self):
+        """
+        执行所有任务，前置任务失败的任务不再执行
+        :return: 任务名称和运行状态的字典
+        """
+        ctx = multiprocessing.get_context('fork')
+        pending = self.load_journal()
+        running = {}
+        if self.target_hosts is not None:
+            total = self.target_hosts
+        else:
+            total = set(self.myansible.failed_hosts).union(*(node.host_set for node in self.nodes))
+
+        while pending or running:
+            if pending and self._over_budget(total):
+                log.error(f'{sorted(self.myansible.failed_hosts & total)} failed, '
+                          f'exceeded max fail percent {self.max_fail_percent}%, abort remaining stages.')
+                for node in pending:
+                    node.status = 'skipped'
+                pending = []
+
+            for node in list(pending):
+                if self._blocked(node):
+                    node.status = 'skipped'
+                    pending.remove(node)
+                    log.error(f'skip stage: {node.name}, prerequisite stage failed.')
+                elif self._ready(node) and len(running) < self.max_workers:
+                    reader, process = self._start(ctx, node)
+                    running[reader] = (node, process)
+                    pending.remove(node)
+
+            if not running:
+                continue
+
+            # 子进程结束前发送失败主机，异常退出时管道关闭，都会使 reader 可读
+            for reader in wait(list(running)):
+                node, process = running.pop(reader)
+                try:
+                    self.myansible.failed_hosts.update(reader.recv())
+                except EOFError:
+                    pass
+                reader.close()
+                process.join()
+                node.end = time.time()
+                if process.exitcode == 0:
+                    node.status = 'success'
+                    log.info(f'finish stage: {node.name} ({node.end - node.start:.1f}s)')
+                    if self.journal is not None:
+                        self._record_journal(node)
+                else:
+                    node.status = 'failed'
+                    log.error(f'stage {node.name} failed, exit code {process.exitcode}.')
+
+        return {node.name: node.status for node in self.nodes}
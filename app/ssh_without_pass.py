@@ -3,6 +3,8 @@
 # Author: Yujichang
 
 import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from app.commom import run_shell_command
 from app.config import config
 from app.log import ssh_distribute_log as log
@@ -51,16 +53,68 @@ class SSHWithoutPass(object):
                 self.pub_key = None
                 log.error(f'create ssh key failed,cause by {result.stderr}')
 
-    def distribute_ssh_key(self, hosts: list, user='root', port=22, password=None):
+    def _probe(self, ip, user, port, timeout):
+        """
+        BatchMode 下不会询问密码，只使用本工具的私钥登录，能直接登录说明主机已经信任该公钥
+        """
+        command = f'ssh -o BatchMode=yes -o ConnectTimeout={timeout} -o StrictHostKeyChecking=no ' \
+                  f'-o IdentitiesOnly=yes -i {self.private_key} -p {port} {user}@{ip} true'
+        try:
+            return run_shell_command(command, timeout=timeout + 5).returncode == 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def _copy_id(self, ip, user, port, password, timeout):
+        """
+        分发公钥到单台主机
+        :return: 运行状态 success、skip 或 failed，以及失败原因
+        """
+        if self._probe(ip, user, port, timeout):
+            return 'skip', 'already trust the key'
+
+        command = f'sshpass -p "{password}" ssh-copy-id -i {self.pub_key} -p {port} ' \
+                  f'-o StrictHostKeyChecking=no -o ConnectTimeout={timeout} {user}@{ip}'
+        try:
+            result = run_shell_command(command, timeout=timeout * 3)
+        except subprocess.TimeoutExpired:
+            return 'failed', f'timeout after {timeout * 3}s'
+
+        if result.returncode == 0:
+            return 'success', ''
+        return 'failed', result.stderr.strip()
+
+    def distribute_ssh_key(self, hosts: list, user='root', port=22, password=None, workers=32, timeout=10):
+        """
+        并行分发公钥，已经信任公钥的主机跳过
+        :param workers: 并行分发的主机数
+        :param timeout: 每台主机的连接超时秒数
+        :return: 每台主机的分发结果，{ip: {'status': success/skip/failed, 'msg': 失败原因}}
+        """
+        report = {}
         if self.pub_key is None:
-            return
+            return report
 
         check_server_sshpass(password)
 
-        for ip in hosts:
-            command = f'sshpass -p "{password}" ssh-copy-id -i {self.pub_key} -p {port} -o StrictHostKeyChecking=no {user}@{ip}'
-            result = run_shell_command(command)
-            if result.returncode == 0:
-                log.info(f'{ip} distribute success.')
-            else:
-                log.error(f'{ip} distribute failed, cause by {result.stderr}')
+        hosts = [str(ip) for ip in hosts if str(ip)]
+        with ThreadPoolExecutor(max_workers=max(min(workers, len(hosts)), 1)) as executor:
+            futures = {ip: executor.submit(self._copy_id, ip, user, port, password, timeout) for ip in hosts}
+
+            for ip, future in futures.items():
+                status, msg = future.result()
+                report[ip] = {'status': status, 'msg': msg}
+                if status == 'success':
+                    log.info(f'{ip} distribute success.')
+                elif status == 'skip':
+                    log.info(f'{ip} {msg}, skip distribute.')
+                else:
+                    log.error(f'{ip} distribute failed, cause by {msg}')
+
+        summary = {status: [ip for ip in report if report[ip]['status'] == status]
+                   for status in ('success', 'skip', 'failed')}
+        log.info(f"distribute ssh key: {len(summary['success'])} success, {len(summary['skip'])} skip, "
+                 f"{len(summary['failed'])} failed.")
+        if summary['failed']:
+            log.error(f"{summary['failed']} distribute ssh key failed.")
+
+        return report
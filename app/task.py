@@ -3,14 +3,21 @@
 # Author: Yujichang
 
 import os
-import pandas as pd
-import json
+import time
+import hashlib
 from app.log import install_log as log
 from app.config import config
 from app.commom import ip_hostname_mapping
+from app.scheduler import requires
+from app.relay import relay_files
+from app.checksum import remote_missing_files
+from app.result import PROBE_VARS
+from app.mirror import mirror_download_task, mirror_extract_task, mirror_url
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 tempdir = '/tmp/cdh_install_temp'
+# parcels 压缩包的暂存目录，与 parcel-repo 在同一文件系统
+parcel_staging = config['parcel_staging']
 
 MYSQL_FILE = config['packages']['mysql']
 JDK_FILE = config['packages']['jdk']
@@ -19,47 +26,176 @@ CDH_CM_FILE = config['packages']['cdh-cm']
 LOG4J_FILE = config['packages']['log4j']
 
 
-def get_yum_status_task(myansible, hosts):
-    task = dict(action=dict(module='shell', args='yum install telnet -y'))
-    myansible.run(hosts=hosts, task=task)
-    result = myansible.get_result()
-
-    # 命令结果转化为 dataframe 格式
-    df = pd.DataFrame.from_dict(json.loads(result).values())
-
-    return df
-
-
 def run_task_list(myansible, hosts, task_list: list, task_name):
     """
-    执行任务列表
+    执行任务列表，所有任务在同一个 play 中执行，与 ansible playbook 相同：
+    某台主机执行一个任务失败后，该主机不再执行列表中后面的任务，其他主机继续执行。
+    失败的主机记入 failed_hosts，之后的阶段也不再执行，因此任务列表只放同一阶段中按顺序执行的步骤，
+    失败后仍需要在该主机上执行的任务单独调用 run_task_list
     :param myansible: ansible 实例
     :param hosts: 主机标签组
     :param task_list: 任务列表
     :param task_name: 任务名称
+    :return: 所有任务每台主机的运行结果 ResultStore
     """
-    # 生成一个空DataFrame，记录任务运行状态
-    df = pd.DataFrame(columns=['host', 'ansible_run_status'])
+    # 任务列表在同一个 play 中提交执行，再按任务顺序取回每台主机的结果
+    start = time.time()
+    myansible.run_tasks(hosts=hosts, tasks=task_list)
+    results = myansible.get_task_result()
 
-    # 提交任务列表执行
-    for task in task_list:
-        myansible.run(hosts=hosts, task=task)
-        result = myansible.get_result()
-        temp = pd.DataFrame.from_dict(json.loads(result).values())
-        df = pd.concat([df, temp], axis=0, sort=False, ignore_index=True)
+    check_results(myansible, hosts, results, task_name, time.time() - start)
+    return results
 
-    # 检查所有主机任务运行状态，记录日志
-    check_run_status = df['ansible_run_status'] == 'success'
-    if check_run_status.all():
-        log.info(f'{hosts} run {task_name} success.')
+
+def check_results(myansible, hosts, results, task_name, elapsed):
+    """
+    检查所有主机任务运行状态，记录日志和失败的主机
+    """
+    if results.all_success():
+        log.info(f'{hosts} run {task_name} success ({elapsed:.1f}s).')
     else:
-        run_host = df[df['ansible_run_status'] != 'success'].drop_duplicates(subset=['host'])['host'].to_list()
-        log.error(f'{run_host} run {task_name} failed.')
+        run_host = results.failed_hosts()
+        log.error(f'{run_host} run {task_name} failed ({elapsed:.1f}s).')
+        myansible.failed_hosts.update(run_host)
 
-        stdout = df[(df['host'].isin(run_host)) & (df['ansible_run_status'] == 'failed')]['stdout'].values
-        stderr = df[(df['host'].isin(run_host)) & (df['ansible_run_status'] == 'failed')]['stderr'].values
+        failed = results.select(status='failed')
+        stdout = [result.get('stdout') for _, _, result in failed]
+        stderr = [result.get('stderr', result.get('msg')) for _, _, result in failed]
         log.error(f'{run_host} stdout: {stdout} stderr: {stderr}')
 
+        # 输出被截断时，完整输出保存在每台主机的文件中
+        output_files = sorted({result['output_file'] for _, _, result in results if 'output_file' in result})
+        if output_files:
+            log.error(f'full output of failed hosts: {output_files}')
+
+
+def wait_async_jobs(myansible, jobs):
+    """
+    等待 start_async 启动的异步任务全部完成，所有任务一起批量轮询，按任务记录日志
+    :param jobs: AsyncJob 列表
+    """
+    start = time.time()
+    myansible.wait_async(jobs, interval=config['async_job']['poll_interval'])
+    for job in jobs:
+        check_results(myansible, job.name, job.results, 'async job', time.time() - start)
+
+
+def run_async_task(myansible, hosts, task, task_name):
+    """
+    以异步方式执行耗时较长的任务（如安装软件包）并轮询到完成，执行时间不受 ssh 连接超时的限制
+    :return: 每台主机的运行结果 ResultStore
+    """
+    job = myansible.start_async(hosts, task, config['async_job']['timeout'], name=f'{hosts} {task_name}')
+    wait_async_jobs(myansible, [job])
+    return job.results
+
+
+def succeeded_hosts(results):
+    """
+    返回所有任务都执行成功的主机标签组，没有成功的主机时返回 None
+    """
+    failed = set(results.failed_hosts())
+    hosts = [host for host in results.hosts() if host not in failed]
+    return ','.join(hosts) + ',' if hosts else None
+
+
+def sync_file_task_list(myansible, hosts, src_list, dest, missing=None):
+    """
+    生成分发文件的任务列表，只分发远程缺失、不完整或校验不一致的文件
+    :param missing: 已有的探测结果，为空时对每台主机执行一次校验探测
+    """
+    if missing is None:
+        missing = remote_missing_files(myansible, hosts, src_list, dest)
+
+    for host, files in missing.items():
+        myansible.variable_manager.set_host_variable(host, 'sync_files', [os.path.basename(src) for src in files])
+
+    need_list = [src for src in src_list if any(src in files for files in missing.values())]
+    if not need_list:
+        return []
+
+    # http 模式下各主机从控制节点的 http 服务并行拉取
+    if config['distribute']['mode'] == 'http':
+        return [mirror_download_task(need_list, dest)]
+
+    task_list = []
+    for src in need_list:
+        name = os.path.basename(src)
+        task_list.append(dict(action=dict(module='copy', args=f'src={src} dest={dest}/{name}'),
+                              when=f"'{name}' in sync_files"))
+
+    return task_list
+
+
+def stream_extract_task(myansible, hosts, src, dest, task_name, members=()):
+    """
+    从控制节点 http 服务边下载边解压，压缩包不保存到主机，并记录每台主机的吞吐量
+    :param src: 控制节点上的 .tar.gz 文件
+    :param dest: 远程解压目录
+    :param members: 可选，只解压匹配这些通配符的文件
+    """
+    results = run_task_list(myansible, hosts, [mirror_extract_task(src, dest, members)], task_name)
+
+    # 任务输出解压耗时和解压程序，按压缩包大小计算吞吐量
+    size = os.path.getsize(src) / 1024 / 1024
+    throughput = {}
+    for host, _, result in results.select(status='success'):
+        elapsed, decompress = result['stdout'].split()[:2]
+        throughput[host] = (size / max(float(elapsed), 0.001), decompress)
+
+    if throughput:
+        average = sum(speed for speed, _ in throughput.values()) / len(throughput)
+        slowest = min(throughput, key=lambda host: throughput[host][0])
+        log.info(f'{hosts} stream {os.path.basename(src)} {size:.1f}MB to {len(throughput)} hosts, '
+                 f'average {average:.1f}MB/s, slowest {slowest} {throughput[slowest][0]:.1f}MB/s '
+                 f'({throughput[slowest][1]}).')
+
+
+def disable_requiretty_task(myansible, hosts, user):
+    """
+    pipelining 模式下 sudo 无法分配 tty，关闭远程用户的 requiretty
+    """
+    log.info(f'{hosts} start run task: disable_requiretty.')
+
+    # 设置任务，写入前使用 visudo 校验
+    task = dict(action=dict(module='copy', args=dict(content=f'Defaults:{user} !requiretty\n',
+                                                     dest=f'/etc/sudoers.d/cdh_install_{user}',
+                                                     mode='0440', validate='visudo -cf %s')))
+
+    # 提交任务执行
+    task_list = [task]
+    run_task_list(myansible, hosts, task_list, 'disable_requiretty')
+
+
+def restore_requiretty_task(myansible, hosts, user):
+    """
+    删除 disable_requiretty_task 写入的 sudoers 配置，恢复远程用户原有的 requiretty 设置
+    """
+    log.info(f'{hosts} start run task: restore_requiretty.')
+
+    # 设置任务，删除 sudoers 配置文件
+    task = dict(action=dict(module='file', args=f'path=/etc/sudoers.d/cdh_install_{user} state=absent'))
+
+    # 提交任务执行
+    task_list = [task]
+    run_task_list(myansible, hosts, task_list, 'restore_requiretty')
+
+
+def configure_yum_repo_task(myansible, hosts):
+    """
+    配置控制节点提供的本地yum源
+    """
+    log.info(f'{hosts} start run task: configure_yum_repo.')
+
+    # 设置任务，metadata_expire=0 保证yum源重新生成后各主机立即使用新的元数据
+    task = dict(action=dict(module='yum_repository',
+                            args=f'name=cdh_install description="cdh install local repo" '
+                                 f'baseurl={mirror_url()}/packages/repo gpgcheck=no metadata_expire=0'))
+
+    # 提交任务执行
+    task_list = [task]
+    run_task_list(myansible, hosts, task_list, 'configure_yum_repo')
+
 
 def modify_hostname_task(myansible, hosts):
     """
@@ -75,24 +211,66 @@ def modify_hostname_task(myansible, hosts):
     run_task_list(myansible, hosts, task_list, 'modify_hostname')
 
 
-def modify_etc_host_task(myansible):
+def _mapping_hash(lines):
+    # 与远程 LC_ALL=C sort | sha256sum 的结果一致
+    return hashlib.sha256(''.join(f'{line}\n' for line in sorted(lines)).encode('utf-8')).hexdigest()
+
+
+@requires(modify_hostname_task)
+def modify_etc_host_task(myansible, hosts='cdh_servers', new_hosts=()):
     """
     修改/etc/hosts文件，添加 ip 主机名映射
+    先探测每台主机映射块的校验值，与完整映射一致的主机跳过；
+    与不含 new_hosts 的映射一致的主机只追加新增主机的映射，其余主机写入完整映射
+    :param new_hosts: 新增的主机，添加 agent 时使用
     """
-    log.info('cdh_servers start run task: modify /etc/host.')
+    log.info(f'{hosts} start run task: modify /etc/host.')
 
-    # 获取ip主机名解析
+    # 获取ip主机名解析，计算新增主机的映射
     host_mapping = ip_hostname_mapping()
+    full_lines = host_mapping.split('\n')
+    added_lines = [f"{host['ip']} {host['name']}" for host in config['host'] if host['ip'] in new_hosts]
+    full_hash = _mapping_hash(full_lines)
+    previous_hash = _mapping_hash([line for line in full_lines if line not in added_lines])
+
+    # 探测映射块的校验值，探测失败的主机写入完整映射
+    probe = "sed -n '/^# BEGIN ANSIBLE MANAGED BLOCK$/,/^# END ANSIBLE MANAGED BLOCK$/{/^# /!p}' /etc/hosts " \
+            "| LC_ALL=C sort | sha256sum | cut -d ' ' -f 1"
+    myansible.run_tasks(hosts=hosts, tasks=[dict(action=dict(module='shell', args=dict(cmd=probe)))])
+    probe_results = myansible.get_task_result()
+
+    mode = {host: 'full' for host in probe_results.hosts()}
+    for host, _, result in probe_results.select(status='success'):
+        if result['stdout'] == full_hash:
+            mode.pop(host)
+        elif added_lines and result['stdout'] == previous_hash:
+            mode[host] = 'append'
+
+    if not mode:
+        log.info(f'{hosts} /etc/hosts is up to date.')
+        return
+    for host, host_mode in mode.items():
+        myansible.variable_manager.set_host_variable(host, 'etc_hosts_mode', host_mode)
+    log.info(f'modify /etc/host: {sum(1 for item in mode.values() if item == "full")} full, '
+             f'{sum(1 for item in mode.values() if item == "append")} append, '
+             f'{len(probe_results.hosts()) - len(mode)} up to date.')
 
     # 删除主机名映射到127.0.0.1的行
-    task1 = dict(action=dict(module='shell', args='sed -i "/127.0.0.1.*{{ hostname }}/d" /etc/hosts'))
+    task1 = dict(action=dict(module='shell', args='sed -i "/127.0.0.1.*{{ hostname }}/d" /etc/hosts'),
+                 when="etc_hosts_mode == 'full'")
 
     # 设置任务，将主机名解析添加到/etc/hosts
-    task2 = dict(action=dict(module='blockinfile', args=f'path=/etc/hosts block="{host_mapping}" backup=yes'))
+    task2 = dict(action=dict(module='blockinfile', args=f'path=/etc/hosts block="{host_mapping}" backup=yes'),
+                 when="etc_hosts_mode == 'full'")
+
+    # 已有完整的旧映射的主机，只在映射块末尾追加新增主机的映射
+    task3 = dict(action=dict(module='lineinfile', args=dict(path='/etc/hosts', line='{{ item }}',
+                                                            insertbefore='^# END ANSIBLE MANAGED BLOCK$')),
+                 loop=added_lines, when="etc_hosts_mode == 'append'")
 
     # 提交任务执行
-    task_list = [task1, task2]
-    run_task_list(myansible, 'cdh_servers', task_list, 'modify /etc/host')
+    task_list = [task1, task2, task3]
+    run_task_list(myansible, ','.join(mode) + ',', task_list, 'modify /etc/host')
 
 
 def distribute_file_task(myansible, hosts):
@@ -101,24 +279,58 @@ def distribute_file_task(myansible, hosts):
     """
     log.info(f'{hosts} start run task: distribute_file.')
 
-    # 要分发的文件
+    # 要分发的安装包，使用本地yum源时各主机不再需要 cloudera manager 安装包，
+    # 流式解压时压缩包在解压时才下载，不需要提前分发
+    package_list = (os.path.join(basedir, f'packages/{JDK_FILE}'),)
+    if not config['distribute']['stream']:
+        package_list += (os.path.join(basedir, f'packages/{LOG4J_FILE}'),)
+    if not config['yum_repo']['enable'] and not config['distribute']['stream']:
+        package_list = (os.path.join(basedir, f'packages/{CDH_CM_FILE}'),) + package_list
+
+    # 要分发的脚本
     src_list = (
-        os.path.join(basedir, f'packages/{CDH_CM_FILE}'),
-        os.path.join(basedir, f'packages/{JDK_FILE}'),
-        os.path.join(basedir, f'packages/{LOG4J_FILE}'),
         os.path.join(basedir, 'scripts/installNTP.sh'),
         os.path.join(basedir, 'scripts/installJDK.sh')
     )
 
+    # 每台主机只探测一次，已经存在且校验一致的文件不再分发
+    missing = remote_missing_files(myansible, hosts, package_list + src_list, tempdir)
+
+    # 中继模式下，安装包由已经收到文件的主机继续分发，失败的主机回退到控制节点直接分发
+    if config['distribute']['mode'] == 'relay':
+        relay_package_task(myansible, package_list, missing)
+    else:
+        src_list = package_list + src_list
+
     # 设置任务
     task_list = [dict(action=dict(module='file', args=f'path={tempdir} state=directory'))]
-    for src in src_list:
-        task_list.append(dict(action=dict(module='copy', args=f'src={src} dest={tempdir} force=no')))
+    task_list += sync_file_task_list(myansible, hosts, src_list, tempdir, missing)
 
     # 提交任务执行
     run_task_list(myansible, hosts, task_list, 'distribute_file')
 
 
+def relay_package_task(myansible, package_list, missing, dest=tempdir):
+    """
+    中继分发安装包到远程目录（默认临时目录），失败的主机回退到控制节点直接分发
+    :param missing: remote_missing_files 的探测结果
+    """
+    distribute = config['distribute']
+    relay_hosts = [host for host, files in missing.items() if set(files) & set(package_list)]
+    failed_hosts = set()
+    if relay_hosts:
+        failed_hosts = relay_files(myansible, ','.join(relay_hosts) + ',', package_list, dest,
+                                   fanout=distribute['fanout'], port=distribute['port'])
+    if failed_hosts:
+        log.warning(f'{sorted(failed_hosts)} relay failed, distribute from control node.')
+        copy_hosts = ','.join(sorted(failed_hosts)) + ','
+        copy_list = sync_file_task_list(myansible, copy_hosts, package_list, dest,
+                                        {host: missing[host] for host in failed_hosts if host in missing})
+        mkdir = dict(action=dict(module='file', args=f'path={dest} state=directory'))
+        run_task_list(myansible, copy_hosts, [mkdir] + copy_list, 'distribute_package')
+
+
+@requires(distribute_file_task)
 def install_jdk_task(myansible, hosts):
     """
     安装jdk1.8
@@ -136,6 +348,7 @@ def install_jdk_task(myansible, hosts):
     run_task_list(myansible, hosts, task_list, 'install_jdk')
 
 
+@requires(distribute_file_task, configure_yum_repo_task)
 def install_ntp_task(myansible, hosts):
     """
     安装ntp
@@ -147,7 +360,7 @@ def install_ntp_task(myansible, hosts):
     creates = os.path.join(tempdir, 'install_ntp_ok_tag')
 
     if config['ntp_external_server'] is None:
-        ntp_server = myansible.inv_obj.get_hosts(pattern='scm_server')[0]
+        ntp_server = myansible.index.group('scm_server')[0]
     else:
         ntp_server = config['ntp_external_server']
 
@@ -158,6 +371,7 @@ def install_ntp_task(myansible, hosts):
     run_task_list(myansible, hosts, task_list, 'install_ntp')
 
 
+@requires(distribute_file_task)
 def update_log4j_task(myansible, hosts):
     """
     更新log4j2版本，修改log4j漏洞
@@ -173,30 +387,38 @@ def update_log4j_task(myansible, hosts):
 
     task2 = dict(action=dict(module='shell', args=f'chdir={log4j_path} sh {script_file}'))
 
-    # 提交任务执行
+    # 流式解压时边下载边解压
     task_list = [task1, task2]
+    if config['distribute']['stream']:
+        stream_extract_task(myansible, hosts, os.path.join(basedir, f'packages/{LOG4J_FILE}'), tempdir,
+                            'stream log4j2')
+        task_list = [task2]
+
+    # 提交任务执行
     run_task_list(myansible, hosts, task_list, 'update log4j2')
 
 
+@requires(distribute_file_task, configure_yum_repo_task)
 def install_mysql_task(myansible, hosts):
     """
     安装mysql5.7
     """
     log.info(f'{hosts} start run task: install_mysql.')
 
-    # 设置任务
-    task_list = []
-
     # 分发mysql二进制安装包和脚本
     src_list = (
         os.path.join(basedir, f'packages/{MYSQL_FILE}'),
         os.path.join(basedir, 'scripts/installMysql.sh')
     )
 
-    for src in src_list:
-        task_list.append(dict(action=dict(module='copy', args=f'src={src} dest={tempdir} force=no')))
+    # 设置任务
+    task_list = sync_file_task_list(myansible, hosts, src_list, tempdir)
+    if task_list:
+        hosts = succeeded_hosts(run_task_list(myansible, hosts, task_list, 'distribute mysql'))
+        if hosts is None:
+            return
 
-    # 执行脚本
+    # 异步执行安装脚本
     mysql_install_path = config['mysql_install_path']
     script_file = os.path.join(tempdir, 'installMysql.sh')
     creates = os.path.join(tempdir, 'install_mysql_ok_tag')
@@ -204,12 +426,10 @@ def install_mysql_task(myansible, hosts):
     task = dict(action=dict(module='shell',
                             args=f'creates={creates} chdir={tempdir} '
                                  f'sh {script_file} {MYSQL_FILE} {mysql_install_path} && touch {creates}'))
-    task_list.append(task)
-
-    # 提交任务执行
-    run_task_list(myansible, hosts, task_list, 'install_mysql')
+    run_async_task(myansible, hosts, task, 'install_mysql')
 
 
+@requires(install_mysql_task)
 def init_mysql_task(myansible, hosts):
     """
     初始化mysql, 修改 mysql 密码，并创建相关数据库和用户
@@ -246,18 +466,18 @@ def get_mysql_master_info_task(myansible, hosts):
 
     myansible.run(hosts=hosts, task=task1)
     myansible.run(hosts=hosts, task=task2)
-    result = myansible.get_result()
-
-    # 命令结果转化为 dataframe 格式
-    df = pd.DataFrame.from_dict(json.loads(result).values())
+    results = myansible.get_result()
 
-    result = df['stdout'].to_list()[0].split()
+    # 取第一台主机最后一个任务的输出
+    _, _, result = results.latest(results.hosts()[0])
+    result = result['stdout'].split()
     master_log_file = result[0]
     master_binlog_pos = int(result[1])
 
     return master_log_file, master_binlog_pos
 
 
+@requires(init_mysql_task, partial=False)
 def configure_mysql_replication(myansible, hosts):
     """
     配置mysql主从同步
@@ -265,7 +485,7 @@ def configure_mysql_replication(myansible, hosts):
     log.info(f'{hosts} start run task: configure_mysql master/slave.')
 
     # 获取主从服务器ip
-    host = myansible.inv_obj.get_groups_dict()[hosts]
+    host = myansible.index.group(hosts)
     master = host[0]
     slave = host[1]
 
@@ -357,11 +577,22 @@ def modify_kernel_task(myansible, hosts):
     run_task_list(myansible, hosts, task_list, 'modify_kernel_option')
 
 
+@requires(distribute_file_task, configure_yum_repo_task)
 def unzip_scm_package_task(myansible, hosts):
     """
     安装scm server 和 agent 前解压安装包和添加mysql驱动包
     """
     log.info(f'{hosts} start run task: unzip_scm_package.')
+
+    # 使用本地yum源时无需解压，mysql驱动包从控制节点的 http 服务下载
+    if config['yum_repo']['enable']:
+        task1 = dict(action=dict(module='file', args='path=/usr/share/java state=directory'))
+        task2 = dict(action=dict(module='get_url', args=f'url={mirror_url()}/packages/repo/cm/'
+                                                        f'mysql-connector-java-5.1.46.jar '
+                                                        f'dest=/usr/share/java/mysql-connector-java.jar'))
+        run_task_list(myansible, hosts, [task1, task2], 'unzip_scm_package')
+        return
+
     # 解压安装包
     task1 = dict(action=dict(module='shell', args=f'chdir={tempdir} tar zxf {CDH_CM_FILE}'))
 
@@ -371,11 +602,19 @@ def unzip_scm_package_task(myansible, hosts):
     task3 = dict(action=dict(module='shell', args=f'/usr/bin/cp -f {mysql_jar_path} '
                                                   f'/usr/share/java/mysql-connector-java.jar'))
 
-    # 提交任务执行
+    # 流式解压时边下载边解压
     task_list = [task1, task2, task3]
+    if config['distribute']['stream']:
+        stream_extract_task(myansible, hosts, os.path.join(basedir, f'packages/{CDH_CM_FILE}'), tempdir,
+                            'stream scm_package')
+        task_list = [task2, task3]
+
+    # 提交任务执行
     run_task_list(myansible, hosts, task_list, 'unzip_scm_package')
 
 
+@requires(distribute_file_task, configure_yum_repo_task, modify_etc_host_task, close_firewall_task,
+          close_selinux_task, modify_kernel_task, install_jdk_task, install_ntp_task)
 def install_scm_agent_task(myansible, hosts, is_server=False):
     log.info(f'{hosts} start run task: install_scm_agent.')
 
@@ -388,11 +627,13 @@ def install_scm_agent_task(myansible, hosts, is_server=False):
     task1 = dict(action=dict(module='shell', args=f'chdir={package_dir} '
                                                   f'yum -y localinstall cloudera-manager-daemons-* && '
                                                   f'yum -y localinstall cloudera-manager-agent-*'))
+    if config['yum_repo']['enable']:
+        task1 = dict(action=dict(module='yum', args='name=cloudera-manager-daemons,cloudera-manager-agent '
+                                                    'state=present disable_gpg_check=yes'))
 
     # 设置agent配置文件，指向cloudera manager server
-    scm_server_ip = myansible.inv_obj.get_groups_dict()['scm_server']
-    scm_server = myansible.inv_obj.get_host(hostname=scm_server_ip[0])
-    scm_server_hostname = myansible.variable_manager.get_vars(host=scm_server).get('hostname')
+    scm_server_ip = myansible.index.group('scm_server')
+    scm_server_hostname = myansible.index.hostname(scm_server_ip[0])
     task2 = dict(action=dict(module='lineinfile', args=f'path=/etc/cloudera-scm-agent/config.ini '
                                                        f'regexp="^server_host=localhost" '
                                                        f'line="server_host={scm_server_hostname}" backup=yes'))
@@ -403,11 +644,15 @@ def install_scm_agent_task(myansible, hosts, is_server=False):
     # 启动cloudera manager agent
     task3 = dict(action=dict(module='service', args='name=cloudera-scm-agent state=started enabled=yes'))
 
-    # 提交任务执行
-    task_list = [task1, task2, task3]
-    run_task_list(myansible, hosts, task_list, 'install_scm_agent')
+    # 提交任务执行，安装包异步执行，安装成功的主机再修改配置并启动 agent
+    installed = succeeded_hosts(run_async_task(myansible, hosts, task1, 'install_scm_agent'))
+    if installed:
+        run_task_list(myansible, installed, [task2, task3], 'install_scm_agent')
 
 
+@requires(distribute_file_task, configure_yum_repo_task, modify_etc_host_task, close_firewall_task,
+          close_selinux_task, modify_kernel_task, install_jdk_task, install_ntp_task,
+          cluster=(init_mysql_task, configure_mysql_replication))
 def install_scm_server_task(myansible, hosts):
     log.info(f'{hosts} start run task: install_scm_server.')
 
@@ -419,6 +664,9 @@ def install_scm_server_task(myansible, hosts):
     task1 = dict(action=dict(module='shell', args=f'chdir={package_dir} '
                                                   f'yum -y localinstall cloudera-manager-daemons-* && '
                                                   f'yum -y localinstall cloudera-manager-server-6.*'))
+    if config['yum_repo']['enable']:
+        task1 = dict(action=dict(module='yum', args='name=cloudera-manager-daemons,cloudera-manager-server '
+                                                    'state=present disable_gpg_check=yes'))
 
     # 渲染scm数据库配置文件
     _db_properties_temp = os.path.join(basedir, 'template/db.properties.j2')
@@ -426,11 +674,22 @@ def install_scm_server_task(myansible, hosts):
     task2 = dict(action=dict(module='template', args=f'src={_db_properties_temp} dest={_db_properties} '
                                                      f'owner="cloudera-scm" group="cloudera-scm" mode="0600"'))
 
-    # 拷贝parcels包
+    # parcel-repo 中的 parcel 包与 .sha 校验一致的主机不再分发和解压 parcels 包，首次安装时校验失败是预期结果
     src = os.path.join(basedir, f'packages/{CDH_PARCELS}')
     dest = '/opt/cloudera/parcel-repo'
-    task3 = dict(action=dict(module='copy', args=f'src={src} dest={dest} force=no'))
-    task4 = dict(action=dict(module='shell', args=f'chdir={dest} tar zxf {CDH_PARCELS} && rm -f {CDH_PARCELS}'))
+    stream = config['distribute']['stream']
+    myansible.run_tasks(hosts=hosts, tasks=[dict(verify_parcels_task(dest), vars=PROBE_VARS)])
+    pending = myansible.get_task_result().failed_hosts()
+    pending_hosts = ','.join(pending) + ','
+    if not pending:
+        log.info(f'{hosts} parcel-repo already verified, skip cdh parcels.')
+
+    # parcel-repo 目录由 server 安装包创建，异步解压先于 server 安装开始，需要先创建目录，安装后再修改属主，
+    # 压缩包暂存在与 parcel-repo 同一文件系统的目录（/tmp 可能是 tmpfs），解压成功后删除
+    parcels_file = os.path.join(parcel_staging, CDH_PARCELS)
+    task4 = dict(action=dict(module='shell', args=f'mkdir -p {dest} && tar zxf {parcels_file} -C {dest} && '
+                                                  f'rm -f {parcels_file}'))
+    task6 = dict(action=dict(module='file', args=f'path={dest} owner=cloudera-scm group=cloudera-scm recurse=yes'))
 
     # 更新log4j
     update_log4j_task(myansible, hosts)
@@ -438,14 +697,116 @@ def install_scm_server_task(myansible, hosts):
     # 启动cloudera manager server
     task5 = dict(action=dict(module='service', args='name=cloudera-scm-server state=started enabled=yes'))
 
-    # 提交任务执行
-    task_list = [task1, task2, task3, task4, task5]
-    run_task_list(myansible, hosts, task_list, 'install_scm_server')
+    # 提交任务执行，安装包异步执行，流式解压时 parcels 包在 server 安装完成后边下载边解压，
+    # 否则 parcels 包分发后与 server 安装同时异步解压，启动 server 前等待两者完成
+    timeout = config['async_job']['timeout']
+    if stream:
+        installed = succeeded_hosts(run_async_task(myansible, hosts, task1, 'install_scm_server'))
+        if installed:
+            run_task_list(myansible, installed, [task2], 'install_scm_server')
+        if pending:
+            stream_extract_task(myansible, pending_hosts, src, dest, 'stream cdh parcels')
+    else:
+        jobs = []
+        if pending:
+            copy_list = sync_file_task_list(myansible, pending_hosts, [src], parcel_staging)
+            mkdir = dict(action=dict(module='file', args=f'path={parcel_staging} state=directory'))
+            run_task_list(myansible, pending_hosts, [mkdir] + copy_list, 'distribute cdh parcels')
+            jobs.append(myansible.start_async(pending_hosts, task4, timeout, name=f'{hosts} extract cdh parcels'))
+        install_job = myansible.start_async(hosts, task1, timeout, name=f'{hosts} install_scm_server')
+        wait_async_jobs(myansible, jobs + [install_job])
+        installed = succeeded_hosts(install_job.results)
+        if installed:
+            run_task_list(myansible, installed, [task2, task6], 'install_scm_server')
+    if installed:
+        run_task_list(myansible, installed, [task5], 'install_scm_server')
 
     # server端也需要安装agent
     install_scm_agent_task(myansible, hosts, is_server=True)
 
 
+# 预置到 parcel 缓存目录的文件
+PARCEL_MEMBERS = ('*.parcel', '*.parcel.sha')
+
+
+def verify_parcels_task(cache_dir, source=None):
+    """
+    生成校验 parcel 缓存目录的任务，每个 parcel 包在后台并行校验，.sha 文件为 sha1 或 sha256
+    校验不一致的文件被删除，没有 parcel 包或任一校验失败时任务失败
+    :param source: 可选，校验失败时先从该目录（如 server 的 parcel-repo）硬链接或复制 parcel 包和 .sha 文件后再校验
+    """
+    script = f'cd {cache_dir} 2>/dev/null && ls *.parcel > /dev/null 2>&1 || exit 1; pids=""; ' \
+             f'for f in *.parcel; do ( sum=$(tr -d "[:space:]" < $f.sha 2>/dev/null); ' \
+             f'case $(printf %s "$sum" | wc -c) in 40) c=sha1sum;; 64) c=sha256sum;; *) rm -f $f $f.sha; exit 1;; esac; ' \
+             f'echo "$sum  $f" | $c -c --quiet - || {{ rm -f $f $f.sha; exit 1; }} ) & pids="$pids $!"; done; ' \
+             f'rc=0; for p in $pids; do wait $p || rc=1; done; exit $rc'
+    if source:
+        files = f'{source}/*.parcel {source}/*.parcel.sha'
+        script = f'check() ( {script} ); check || {{ ls {source}/*.parcel > /dev/null 2>&1 && mkdir -p {cache_dir} && ' \
+                 f'{{ cp -pl {files} {cache_dir}/ 2>/dev/null || cp -p {files} {cache_dir}/; }} && check; }}'
+    return dict(action=dict(module='shell', args=dict(cmd=script, executable='/bin/bash')))
+
+
+@requires(distribute_file_task, install_scm_server_task, install_scm_agent_task)
+def preseed_parcels_task(myansible, hosts):
+    """
+    把 parcels 包和 .sha 文件预置到 agent 的 parcel 缓存目录并在各主机并行校验，
+    cloudera manager 分发 parcels 时不再从 server 下载。预置失败不影响安装，由 cloudera manager 正常分发
+    在 agent 安装之后执行，缓存目录属主改为 agent 运行用户 cloudera-scm
+    """
+    log.info(f'{hosts} start run task: preseed_parcels.')
+
+    src = os.path.join(basedir, f'packages/{CDH_PARCELS}')
+    cache_dir = config['parcel_preseed']['dir']
+    verify = verify_parcels_task(cache_dir)
+    chown = dict(action=dict(module='file', args=f'path={cache_dir} owner=cloudera-scm group=cloudera-scm '
+                                                 f'recurse=yes'))
+    failed_before = set(myansible.failed_hosts)
+
+    # 已经预置且校验一致的主机跳过，server 主机从已校验的 parcel-repo 链接，不再分发压缩包，
+    # 首次预置时校验失败是预期结果
+    probe = verify_parcels_task(cache_dir, source='/opt/cloudera/parcel-repo')
+    myansible.run_tasks(hosts=hosts, tasks=[dict(probe, vars=PROBE_VARS)])
+    results = myansible.get_task_result()
+    pending = results.failed_hosts()
+    if not pending:
+        log.info(f'{hosts} parcels already preseeded.')
+        run_task_list(myansible, hosts, [chown], 'chown cdh parcels')
+        return
+    pending_hosts = ','.join(pending) + ','
+
+    # 按分发配置选择最快的方式：流式解压时直接从控制节点边下载边解压，
+    # 否则压缩包按中继或 http、copy 方式分发到暂存目录后只解压 parcel 包和 .sha 文件，解压后删除压缩包
+    if config['distribute']['stream']:
+        stream_extract_task(myansible, pending_hosts, src, cache_dir, 'stream cdh parcels', members=PARCEL_MEMBERS)
+    else:
+        missing = remote_missing_files(myansible, pending_hosts, [src], parcel_staging)
+        copy_list = []
+        if config['distribute']['mode'] == 'relay':
+            relay_package_task(myansible, [src], missing, dest=parcel_staging)
+        else:
+            mkdir = dict(action=dict(module='file', args=f'path={parcel_staging} state=directory'))
+            copy_list = [mkdir] + sync_file_task_list(myansible, pending_hosts, [src], parcel_staging, missing)
+
+        members = ' '.join(f"'{member}'" for member in PARCEL_MEMBERS)
+        extract = dict(action=dict(module='shell', args=f'mkdir -p {cache_dir} && '
+                                                        f'tar zxf {parcel_staging}/{CDH_PARCELS} '
+                                                        f'-C {cache_dir} --wildcards {members} && '
+                                                        f'rm -f {parcel_staging}/{CDH_PARCELS}'))
+        run_task_list(myansible, pending_hosts, copy_list + [extract], 'distribute cdh parcels')
+
+    run_task_list(myansible, pending_hosts, [verify], 'verify cdh parcels')
+    run_task_list(myansible, hosts, [chown], 'chown cdh parcels')
+
+    # 预置只是加速 cloudera manager 分发，失败的主机不计入安装失败
+    preseed_failed = myansible.failed_hosts - failed_before
+    if preseed_failed:
+        log.warning(f'{sorted(preseed_failed)} preseed parcels failed, cloudera manager will distribute parcels '
+                    f'from server.')
+        myansible.failed_hosts -= preseed_failed
+
+
+@requires(modify_etc_host_task, configure_yum_repo_task)
 def install_haproxy_task(myansible, hosts):
     """
     安装haproxy
@@ -468,14 +829,23 @@ def install_haproxy_task(myansible, hosts):
 
 
 class BaseTemple(object):
-    def __init__(self, myansible, hosts):
+    def __init__(self, myansible, hosts, new_hosts=()):
+        """
+        :param new_hosts: 添加 agent 时的所有新增主机，/etc/hosts 只对已有主机追加新增的映射
+        """
         self.myansible = myansible
         self.hosts = hosts
+        self.new_hosts = tuple(new_hosts)
+        # 新增主机可能不在 cdh_servers 组中，同时修改本批主机
+        self.etc_hosts = f'cdh_servers,{hosts}' if new_hosts else 'cdh_servers'
 
     def run_task(self):
+        if config['yum_repo']['enable']:
+            configure_yum_repo_task(self.myansible, self.hosts)
+
         distribute_file_task(self.myansible, self.hosts)
         modify_hostname_task(self.myansible, self.hosts)
-        modify_etc_host_task(self.myansible)
+        modify_etc_host_task(self.myansible, self.etc_hosts, new_hosts=self.new_hosts)
         close_firewall_task(self.myansible, self.hosts)
         close_selinux_task(self.myansible, self.hosts)
         modify_kernel_task(self.myansible, self.hosts)
@@ -483,6 +853,20 @@ class BaseTemple(object):
         install_jdk_task(self.myansible, self.hosts)
         install_ntp_task(self.myansible, self.hosts)
 
+    def plan(self, graph):
+        if config['yum_repo']['enable']:
+            graph.add(configure_yum_repo_task, self.hosts)
+
+        graph.add(distribute_file_task, self.hosts)
+        graph.add(modify_hostname_task, self.hosts)
+        graph.add(modify_etc_host_task, self.etc_hosts, new_hosts=self.new_hosts)
+        graph.add(close_firewall_task, self.hosts)
+        graph.add(close_selinux_task, self.hosts)
+        graph.add(modify_kernel_task, self.hosts)
+
+        graph.add(install_jdk_task, self.hosts)
+        graph.add(install_ntp_task, self.hosts)
+
 
 class DBTemple(object):
     def __init__(self, myansible, hosts):
@@ -496,6 +880,13 @@ class DBTemple(object):
         if config['ha']:
             configure_mysql_replication(self.myansible, self.hosts)
 
+    def plan(self, graph):
+        graph.add(install_mysql_task, self.hosts)
+        graph.add(init_mysql_task, self.hosts)
+
+        if config['ha']:
+            graph.add(configure_mysql_replication, self.hosts)
+
 
 class ScmServerTemple(object):
     def __init__(self, myansible, hosts):
@@ -505,6 +896,15 @@ class ScmServerTemple(object):
     def run_task(self):
         install_scm_server_task(self.myansible, self.hosts)
 
+        if config['parcel_preseed']['enable']:
+            preseed_parcels_task(self.myansible, self.hosts)
+
+    def plan(self, graph):
+        graph.add(install_scm_server_task, self.hosts)
+
+        if config['parcel_preseed']['enable']:
+            graph.add(preseed_parcels_task, self.hosts)
+
 
 class ScmAgentTemple(object):
     def __init__(self, myansible, hosts):
@@ -514,6 +914,15 @@ class ScmAgentTemple(object):
     def run_task(self):
         install_scm_agent_task(self.myansible, self.hosts)
 
+        if config['parcel_preseed']['enable']:
+            preseed_parcels_task(self.myansible, self.hosts)
+
+    def plan(self, graph):
+        graph.add(install_scm_agent_task, self.hosts)
+
+        if config['parcel_preseed']['enable']:
+            graph.add(preseed_parcels_task, self.hosts)
+
 
 class HATemple(object):
     def __init__(self, myansible, haproxy_hosts):
@@ -522,3 +931,7 @@ class HATemple(object):
 
     def run_task(self):
         install_haproxy_task(self.myansible, self.haproxy_hosts)
+
+    def plan(self, graph):
+        graph.add(install_haproxy_task, self.haproxy_hosts)
+
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import shutil
+from app.commom import run_shell_command
+from app.config import config
+from app.checksum import checksum_index
+from app.log import install_log as log
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# 本地yum源目录，通过控制节点的 http 服务以 /packages/repo 提供给各主机
+REPO_DIR = os.path.join(basedir, 'packages/repo')
+# 离线依赖包目录，如 ntp、haproxy、bison、libaio、telnet 及其依赖
+DEPS_DIR = os.path.join(basedir, 'packages/rpms')
+
+
+def _repo_source():
+    # 生成yum源用到的文件标识，文件没有变化时不重复生成
+    cm_file = os.path.join(basedir, f"packages/{config['packages']['cdh-cm']}")
+    source = [f'{os.path.basename(cm_file)} {checksum_index.get(cm_file)}']
+
+    if os.path.isdir(DEPS_DIR):
+        for name in sorted(os.listdir(DEPS_DIR)):
+            if name.endswith('.rpm'):
+                source.append(f'{name} {os.path.getsize(os.path.join(DEPS_DIR, name))}')
+
+    return cm_file, '\n'.join(source)
+
+
+def build_yum_repo():
+    """
+    在控制节点生成本地yum源，包含 cloudera manager rpm 包和离线依赖包
+    :return: 是否生成成功
+    """
+    cm_file, source = _repo_source()
+    marker = os.path.join(REPO_DIR, '.source')
+
+    if os.path.exists(os.path.join(REPO_DIR, 'repodata/repomd.xml')) and os.path.exists(marker):
+        with open(marker) as file:
+            if file.read() == source:
+                log.info('local yum repo is up to date.')
+                return True
+
+    createrepo = shutil.which('createrepo_c') or shutil.which('createrepo')
+    if createrepo is None:
+        log.error('createrepo is not installed on control node, cannot build local yum repo.')
+        return False
+
+    shutil.rmtree(REPO_DIR, True)
+    os.makedirs(os.path.join(REPO_DIR, 'cm'))
+
+    # 解压 cloudera manager 安装包，压缩包内文件在 packages 目录下
+    result = run_shell_command(f'tar zxf {cm_file} -C {REPO_DIR}/cm --strip-components=1')
+    if result.returncode != 0:
+        log.error(f'unzip {cm_file} failed, cause by {result.stderr}')
+        return False
+
+    if os.path.isdir(DEPS_DIR):
+        deps_dir = os.path.join(REPO_DIR, 'deps')
+        os.makedirs(deps_dir)
+        for name in os.listdir(DEPS_DIR):
+            if name.endswith('.rpm'):
+                shutil.copy2(os.path.join(DEPS_DIR, name), deps_dir)
+
+    result = run_shell_command(f'{createrepo} {REPO_DIR}')
+    if result.returncode != 0:
+        log.error(f'create local yum repo failed, cause by {result.stderr}')
+        return False
+
+    with open(marker, 'w') as file:
+        file.write(source)
+
+    log.info(f'local yum repo build complete: {REPO_DIR}')
+    return True
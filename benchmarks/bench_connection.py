@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+对比 default 与 performance 连接配置下执行一遍 BaseTemple 的耗时，需要使用 ssh 连接的真实主机
+BaseTemple 的任务会修改主机配置（与正式安装相同，可重复执行），请使用测试环境
+先运行一遍预热，使两种配置都在文件已分发、配置已修改的状态下对比，两种配置使用相同的 forks，只比较连接配置的差异
+用法：python benchmarks/bench_connection.py --inventory conf/hosts --hosts cdh_servers --forks 50
+"""
+
+import argparse
+from common import timeit
+from app.ansible_api import MyAnsible
+from app.commom import set_config_by_ansible, set_ansible_by_config
+from app.task import BaseTemple, disable_requiretty_task, restore_requiretty_task
+
+
+def run_base(inventory, hosts, user, forks, profile, become_password=None):
+    """
+    与正式安装相同地加载配置和提权，非 root 用户使用 performance 配置时先关闭 requiretty，
+    只计时 BaseTemple 的执行
+    :return: BaseTemple 的执行耗时（秒）
+    """
+    become = {} if user == 'root' else dict(become=True, become_method='sudo', become_user='root')
+    with MyAnsible(inventory=inventory, remote_user=user, forks=forks, verbosity=0, **become) as myansible:
+        if become_password:
+            myansible.variable_manager.extra_vars.update({'ansible_become_password': become_password})
+        set_config_by_ansible(myansible)
+        set_ansible_by_config(myansible)
+
+        sudoers = profile == 'performance' and user != 'root'
+        if sudoers:
+            disable_requiretty_task(myansible, hosts, user)
+        myansible.set_connection_profile(profile)
+        try:
+            return timeit(BaseTemple(myansible, hosts).run_task)
+        finally:
+            if sudoers:
+                restore_requiretty_task(myansible, hosts, user)
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark ssh connection profiles with BaseTemple')
+    parse.add_argument('--inventory', required=True, help='Ansible inventory file')
+    parse.add_argument('--hosts', default='cdh_servers', help='Host group to run BaseTemple on')
+    parse.add_argument('-u', '--user', default='root', help='Remote user, must be able to login without password')
+    parse.add_argument('-p', '--become-password', help='Sudo password of a non-root remote user')
+    parse.add_argument('--forks', type=int, default=50, help='Forks used by both profiles')
+    args = parse.parse_args()
+
+    options = (args.inventory, args.hosts, args.user, args.forks)
+    run_base(*options, 'default', args.become_password)
+
+    default = run_base(*options, 'default', args.become_password)
+    performance = run_base(*options, 'performance', args.become_password)
+
+    print(f'hosts={args.hosts} forks={args.forks}')
+    print(f'default    : {default:.3f}s')
+    print(f'performance: {performance:.3f}s')
+    print(f'speedup    : {default / performance:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+使用 -X importtime 统计 main.py --help 的导入耗时，防止启动变慢
+导入了重量级模块或导入耗时超过预算时以非零状态退出
+用法：python benchmarks/bench_import.py --repeat 5 --budget-ms 150
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# --help 和参数错误时不应该导入的模块
+FORBIDDEN = ('ansible', 'yaml', 'app.config', 'app.ansible_api', 'app.task', 'app.install')
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(argv):
+    """
+    返回顶层模块和累计导入耗时（微秒）的字典，以及导入的所有模块
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv, cwd=basedir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, encoding='utf-8')
+    top = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        modules.add(name)
+        if len(indent) == 1:
+            top[name] = cumulative
+    return top, modules
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark cli import time')
+    parse.add_argument('--repeat', type=int, default=5, help='Number of runs, the median is reported')
+    parse.add_argument('--budget-ms', type=float, default=150, help='Fail when median import time exceeds this value')
+    parse.add_argument('argv', nargs='*', default=['main.py', '--help'], help='Script and arguments to measure')
+    args = parse.parse_args()
+
+    totals = []
+    for _ in range(args.repeat):
+        top, modules = import_times(args.argv)
+        totals.append(sum(top.values()) / 1000)
+
+    median = statistics.median(totals)
+    print(f"{' '.join(args.argv)}: median import time {median:.1f}ms over {args.repeat} runs")
+    for name, cumulative in sorted(top.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f'  {cumulative / 1000:8.1f}ms  {name}')
+
+    heavy = sorted(name for name in modules if name.split('.')[0] in FORBIDDEN or name in FORBIDDEN)
+    if heavy:
+        print(f'heavy modules imported: {heavy}')
+    if median > args.budget_ms:
+        print(f'import time exceeded budget {args.budget_ms}ms')
+    if heavy or median > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+对比每次调用 get_groups_dict、get_vars 与资产快照 InventoryIndex 的主机、主机名和组查询耗时
+用法：python benchmarks/bench_inventory.py --hosts 2000 --lookups 20
+"""
+
+import os
+import argparse
+import tempfile
+from common import timeit
+from app.ansible_api import MyAnsible
+
+
+def write_inventory(count):
+    lines = ['[scm_server]', '10.0.0.1 hostname=node0001', '[db_server]', '10.0.0.1', '[scm_agent]']
+    for i in range(1, count):
+        lines.append(f'10.{i // 65536}.{i // 256 % 256}.{i % 256 + 1} hostname=node{i + 1:04d}')
+    lines += ['[cdh_servers:children]', 'scm_server', 'scm_agent', '[cdh_servers:vars]', 'ansible_port=22']
+
+    fd, path = tempfile.mkstemp(prefix='bench_inventory_', text=True)
+    with os.fdopen(fd, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    return path
+
+
+def lookup_vars(myansible, lookups):
+    # 原来的方式：set_config_by_ansible 对每台主机 get_vars，任务函数每次运行重新查询组和主机名
+    inv_obj, variable_manager = myansible.inv_obj, myansible.variable_manager
+    mapping = []
+    for ip in inv_obj.get_groups_dict()['all']:
+        host_vars = variable_manager.get_vars(host=inv_obj.get_host(hostname=ip))
+        mapping.append({'ip': ip, 'name': host_vars.get('hostname')})
+
+    for _ in range(lookups):
+        scm_server = inv_obj.get_host(hostname=inv_obj.get_groups_dict()['scm_server'][0])
+        variable_manager.get_vars(host=scm_server).get('hostname')
+        inv_obj.get_groups_dict()['db_server']
+    return mapping
+
+
+def lookup_index(myansible, lookups):
+    index = myansible.index
+    mapping = [{'ip': ip, 'name': index.hostname(ip)} for ip in index.group('all')]
+
+    for _ in range(lookups):
+        index.hostname(index.group('scm_server')[0])
+        index.group('db_server')
+    return mapping
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark inventory lookups')
+    parse.add_argument('--hosts', type=int, default=2000, help='Number of hosts in the inventory')
+    parse.add_argument('--lookups', type=int, default=20, help='Number of group and hostname lookups by tasks')
+    args = parse.parse_args()
+
+    inventory = write_inventory(args.hosts)
+    try:
+        myansible = MyAnsible(inventory=inventory, verbosity=0)
+        expected = []
+        get_vars = timeit(lambda: expected.extend(lookup_vars(myansible, args.lookups)))
+
+        mapping = []
+        index = timeit(lambda: mapping.extend(lookup_index(myansible, args.lookups)))
+    finally:
+        os.remove(inventory)
+
+    print(f'hosts={args.hosts} lookups={args.lookups} same result: {mapping == expected}')
+    print(f'get_vars: {get_vars:.3f}s')
+    print(f'index   : {index:.3f}s (including building the snapshot)')
+    print(f'speedup : {get_vars / index:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
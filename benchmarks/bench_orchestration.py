@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+编排层基准测试：在 N 台本地替身主机上执行完整安装流程的所有阶段（app.task 中的任务函数和任务图），
+ansible 模块全部替换为直接返回成功的桩模块，不修改本机，安装包用临时目录下很小的桩文件代替，
+只测量编排层（任务图、ansible 执行上下文、回调和结果汇总）的开销
+每个主机数在单独的子进程中执行，记录墙钟时间、控制节点 CPU 时间、最大内存和每个任务的开销，
+--output 追加 JSONL 记录，用于跟踪编排层的性能回退
+用法：python benchmarks/bench_orchestration.py --hosts 10,100,1000 --forks 50 --output logs/bench.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from common import basedir, cluster_inventory
+
+# app.task 中用到的 ansible 模块，全部由桩模块代替
+STUB_MODULES = ('async_status', 'blockinfile', 'copy', 'file', 'get_url', 'hostname', 'lineinfile', 'ping',
+                'service', 'shell', 'template', 'yum', 'yum_repository')
+
+# 桩模块：按主机变量 stub_delay 等待后返回成功，异步任务返回 job id，async_status 返回已完成
+STUB_SOURCE = '''
+import time
+import uuid
+from ansible.plugins.action import ActionBase
+
+
+class ActionModule(ActionBase):
+    def run(self, tmp=None, task_vars=None):
+        time.sleep(float((task_vars or {}).get('stub_delay', 0)))
+        result = dict(changed=True, rc=0, stdout='', stderr='')
+        if self._task.action == 'async_status':
+            result.update(finished=1, ansible_job_id=self._task.args.get('jid'))
+        elif self._task.async_val:
+            result.update(started=1, finished=0, ansible_job_id=uuid.uuid4().hex)
+        return result
+'''
+
+COLUMNS = ('hosts', 'wall', 'cpu', 'max_rss', 'stages', 'tasks', 'results', 'per_task', 'cpu_per_result')
+
+
+def install_stubs(plugin_dir):
+    """
+    在 plugin_dir 下为每个模块生成同名的桩 action 插件，并优先于 ansible 自带插件加载
+    """
+    from ansible.plugins.loader import action_loader
+
+    for module in STUB_MODULES:
+        with open(os.path.join(plugin_dir, f'{module}.py'), 'w') as file:
+            file.write(STUB_SOURCE)
+    action_loader.add_directory(plugin_dir)
+
+
+def stub_packages(work_dir):
+    """
+    在 work_dir 下生成临时的项目目录：packages 下是安装包的桩文件，scripts 和 template 链接到项目目录，
+    任务函数、校验值索引和 http 服务改为使用临时目录，不读写项目的 packages 目录
+    """
+    import app.task
+    import app.mirror
+    import app.checksum
+    from app.config import config
+
+    stub_dir = os.path.join(work_dir, 'basedir')
+    os.makedirs(os.path.join(stub_dir, 'packages'))
+    for name in ('scripts', 'template'):
+        os.symlink(os.path.join(basedir, name), os.path.join(stub_dir, name))
+    for name in config['packages'].values():
+        with open(os.path.join(stub_dir, 'packages', name), 'wb') as file:
+            file.write(name.encode('utf-8'))
+
+    for module in (app.task, app.mirror, app.checksum):
+        module.basedir = stub_dir
+    app.checksum.checksum_index.path = os.path.join(stub_dir, 'packages/.checksum_index.json')
+
+
+def run_single(count, forks, parallel_stages, strategy, delay):
+    """
+    在当前进程中执行一次完整安装流程，返回测量结果
+    """
+    from app.ansible_api import MyAnsible
+    from app.scheduler import TaskGraph
+    from app.report import read_events
+    from app.commom import set_config_by_ansible, set_ansible_by_config
+    from app.task import BaseTemple, DBTemple, ScmServerTemple, ScmAgentTemple
+
+    # 桩模块全部成功，不写安装日志
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_orchestration_')
+    inventory = cluster_inventory(count, lambda i: f'stub_delay={delay}')
+    event_log = os.path.join(work_dir, 'events.jsonl')
+    try:
+        stub_packages(work_dir)
+        install_stubs(work_dir)
+
+        start = time.perf_counter()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with MyAnsible(inventory=inventory, forks=forks, strategy=strategy, event_log=event_log,
+                       verbosity=0) as myansible:
+            set_config_by_ansible(myansible)
+            set_ansible_by_config(myansible)
+            graph = TaskGraph(myansible, max_workers=parallel_stages)
+            BaseTemple(myansible, hosts='cdh_servers').plan(graph)
+            DBTemple(myansible, hosts='db_server').plan(graph)
+            ScmServerTemple(myansible, hosts='scm_server').plan(graph)
+            ScmAgentTemple(myansible, hosts='scm_agent').plan(graph)
+            status = graph.run()
+        wall = time.perf_counter() - start
+
+        # 子进程（阶段进程和 ansible 工作进程）结束后才计入 RUSAGE_CHILDREN
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+        children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (usage_end.ru_utime + usage_end.ru_stime - usage.ru_utime - usage.ru_stime +
+               children_end.ru_utime + children_end.ru_stime - children.ru_utime - children.ru_stime)
+
+        events = read_events(event_log)
+    finally:
+        shutil.rmtree(work_dir, True)
+        os.remove(inventory)
+
+    tasks = len({event['task_id'] for event in events})
+    return {
+        'time': time.time(), 'hosts': count, 'forks': forks, 'parallel_stages': parallel_stages,
+        'strategy': strategy, 'delay': delay,
+        'wall': round(wall, 3), 'cpu': round(cpu, 3),
+        'max_rss': max(usage_end.ru_maxrss, children_end.ru_maxrss) // 1024,
+        'stages': len(status), 'failed_stages': sorted(name for name, value in status.items() if value != 'success'),
+        'tasks': tasks, 'results': len(events),
+        'per_task': round(wall / tasks * 1000, 1) if tasks else None,
+        'cpu_per_result': round(cpu / len(events) * 1000, 2) if events else None,
+    }
+
+
+def format_row(record):
+    values = dict(record, wall=f"{record['wall']:.1f}s", cpu=f"{record['cpu']:.1f}s",
+                  max_rss=f"{record['max_rss']}M", per_task=f"{record['per_task']}ms",
+                  cpu_per_result=f"{record['cpu_per_result']}ms")
+    return '  '.join(str(values[column]).rjust(len(column) + 4) for column in COLUMNS)
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark the orchestration layer with stub modules on stand-in hosts')
+    parse.add_argument('--hosts', default='10,100', help='Comma separated host counts, e.g. 10,100,1000')
+    parse.add_argument('--forks', type=int, default=50, help='Number of hosts ansible runs on in parallel')
+    parse.add_argument('--stages', type=int, default=4, help='Number of stages run in parallel')
+    parse.add_argument('--strategy', choices=['linear', 'free'], default='linear', help='Ansible strategy')
+    parse.add_argument('--delay', type=float, default=0, help='Seconds each stub module sleeps')
+    parse.add_argument('--output', help='Append one JSON record per host count to this file')
+    parse.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parse.parse_args()
+
+    if args.single:
+        record = run_single(args.single, args.forks, args.stages, args.strategy, args.delay)
+        print(json.dumps(record))
+        return
+
+    print('  '.join(column.rjust(len(column) + 4) for column in COLUMNS))
+    for count in [int(value) for value in args.hosts.split(',') if value.strip()]:
+        # 每个主机数单独一个进程，最大内存和 CPU 时间互不影响
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', str(count),
+                                 '--forks', str(args.forks), '--stages', str(args.stages),
+                                 '--strategy', args.strategy, '--delay', str(args.delay)],
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        record = json.loads(output.strip().splitlines()[-1])
+        print(format_row(record))
+        if record['failed_stages']:
+            print(f"  failed stages: {', '.join(record['failed_stages'])}")
+
+        if args.output:
+            with open(args.output, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
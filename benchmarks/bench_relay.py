@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+使用本地替身主机对比控制节点直接分发和中继分发，每台替身主机使用独立的目录和 http 端口
+用法：python benchmarks/bench_relay.py --hosts 16 --size 64 --fanout 2
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+from common import local_inventory, timeit
+from app.ansible_api import MyAnsible
+from app.commom import file_checksum
+from app.relay import relay_files
+
+
+def copy_files(myansible, src, dest):
+    task_list = [dict(action=dict(module='file', args=f'path={dest} state=directory')),
+                 dict(action=dict(module='copy', args=f'src={src} dest={dest}/'))]
+    myansible.run_tasks(hosts='cdh_servers', tasks=task_list)
+    myansible.get_task_result()
+
+
+def verify(workdir, count, src):
+    checksum = file_checksum(src)
+    name = os.path.basename(src)
+    paths = [os.path.join(workdir, f'standin{i:04d}', name) for i in range(count)]
+    return sum(1 for path in paths if os.path.exists(path) and file_checksum(path) == checksum)
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark relay distribution with local stand-in hosts')
+    parse.add_argument('--hosts', type=int, default=16, help='Number of local stand-in hosts')
+    parse.add_argument('--size', type=int, default=64, help='Package size in MB')
+    parse.add_argument('--fanout', type=int, default=2, help='Hosts served by each source per wave')
+    parse.add_argument('--port', type=int, default=19000, help='First http port of stand-in hosts')
+    args = parse.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_relay_')
+    src = os.path.join(workdir, 'package.tar.gz')
+    with open(src, 'wb') as file:
+        file.write(os.urandom(args.size * 1024 * 1024))
+
+    inventory = local_inventory(args.hosts, host_vars=lambda i: f'relay_address=127.0.0.1 relay_port={args.port + i}')
+    dest = os.path.join(workdir, '{{ inventory_hostname }}')
+
+    try:
+        with MyAnsible(inventory=inventory, verbosity=0) as myansible:
+            copy = timeit(copy_files, myansible, src, dest)
+            copy_ok = verify(workdir, args.hosts, src)
+
+            for i in range(args.hosts):
+                shutil.rmtree(os.path.join(workdir, f'standin{i:04d}'))
+
+            failed = set()
+            relay = timeit(lambda: failed.update(relay_files(myansible, 'cdh_servers', [src], dest,
+                                                             fanout=args.fanout, port=args.port)))
+            relay_ok = verify(workdir, args.hosts, src)
+    finally:
+        os.remove(inventory)
+        shutil.rmtree(workdir, True)
+
+    print(f'hosts={args.hosts} size={args.size}MB fanout={args.fanout}')
+    print(f'copy : {copy:.3f}s, {copy_ok}/{args.hosts} verified')
+    print(f'relay: {relay:.3f}s, {relay_ok}/{args.hosts} verified, failed={sorted(failed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+对比 run_task_list 原来的 json 往返加 pandas 逐任务拼接与 ResultStore 的结果汇总耗时，
+使用构造的模块返回结果，不需要执行 ansible，安装了 pandas 时才运行原来的方式
+用法：python benchmarks/bench_results.py --hosts 1000 2000 5000 --tasks 5
+"""
+
+import json
+import argparse
+from common import timeit
+from app.result import ResultStore
+
+
+def fake_results(hosts, tasks, fail_every=50):
+    # 每个任务每台主机一条结果，每 fail_every 台主机有一台失败
+    for task in range(tasks):
+        for i in range(hosts):
+            status = 'failed' if i % fail_every == fail_every - 1 and task == tasks - 1 else 'success'
+            result = {'cmd': f'task {task}', 'stdout': f'standin{i:05d} ok', 'stderr': '',
+                      'rc': 0 if status == 'success' else 1,
+                      'start': '2021-01-01 00:00:00.000000', 'end': '2021-01-01 00:00:01.000000',
+                      'delta': '0:00:01.000000', 'changed': True}
+            yield task, f'standin{i:05d}', status, result
+
+
+def pandas_aggregate(records, tasks):
+    import pandas as pd
+
+    # 原来的方式：每个任务的结果 json 序列化后再解析，逐任务 concat 成 DataFrame
+    task_result = [{} for _ in range(tasks)]
+    for task, host, status, result in records:
+        task_result[task][host] = dict(result, ansible_run_status=status, host=host)
+
+    df = pd.DataFrame(columns=['host', 'ansible_run_status'])
+    for result in [json.dumps(raw) for raw in task_result]:
+        temp = pd.DataFrame.from_dict(json.loads(result).values())
+        df = pd.concat([df, temp], axis=0, sort=False, ignore_index=True)
+
+    if not (df['ansible_run_status'] == 'success').all():
+        run_host = df[df['ansible_run_status'] != 'success'].drop_duplicates(subset=['host'])['host'].to_list()
+        failed = df[(df['host'].isin(run_host)) & (df['ansible_run_status'] == 'failed')]
+        return run_host, failed['stdout'].values, failed['stderr'].values
+
+
+def store_aggregate(records, tasks):
+    results = ResultStore()
+    for task, host, status, result in records:
+        results.add(host, status, result)
+
+    if not results.all_success():
+        run_host = results.failed_hosts()
+        failed = results.select(status='failed')
+        return run_host, [result.get('stdout') for _, _, result in failed], \
+            [result.get('stderr') for _, _, result in failed]
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark task result aggregation')
+    parse.add_argument('--hosts', type=int, nargs='+', default=[1000, 2000, 5000], help='Number of hosts')
+    parse.add_argument('--tasks', type=int, default=5, help='Number of tasks per run_task_list')
+    args = parse.parse_args()
+
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+        print('pandas is not installed, only ResultStore is measured.')
+
+    for hosts in args.hosts:
+        records = list(fake_results(hosts, args.tasks))
+        store = timeit(store_aggregate, records, args.tasks)
+        line = f'hosts={hosts} tasks={args.tasks} store: {store * 1000:.1f}ms'
+        if pandas is not None:
+            old = timeit(pandas_aggregate, records, args.tasks)
+            line += f' pandas: {old * 1000:.1f}ms speedup: {old / store:.1f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
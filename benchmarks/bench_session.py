@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+对比每个步骤单独创建 TaskQueueManager 与会话内复用 TaskQueueManager 的开销
+用法：python benchmarks/bench_session.py --hosts 20 --steps 20
+"""
+
+import os
+import argparse
+from common import local_inventory, timeit
+from app.ansible_api import MyAnsible
+
+
+def run_steps(myansible, steps):
+    task = dict(action=dict(module='ping', args=''))
+    for _ in range(steps):
+        myansible.run_tasks(hosts='cdh_servers', tasks=[task])
+        myansible.get_task_result()
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark MyAnsible session reuse')
+    parse.add_argument('--hosts', type=int, default=20, help='Number of local stand-in hosts')
+    parse.add_argument('--steps', type=int, default=20, help='Number of run_task_list steps')
+    args = parse.parse_args()
+
+    inventory = local_inventory(args.hosts)
+    try:
+        myansible = MyAnsible(inventory=inventory, verbosity=0)
+        oneshot = timeit(run_steps, myansible, args.steps)
+
+        myansible = MyAnsible(inventory=inventory, verbosity=0)
+        with myansible:
+            session = timeit(run_steps, myansible, args.steps)
+    finally:
+        os.remove(inventory)
+
+    print(f'hosts={args.hosts} steps={args.steps}')
+    print(f'one-shot: {oneshot:.3f}s total, {oneshot / args.steps * 1000:.1f}ms per step')
+    print(f'session : {session:.3f}s total, {session / args.steps * 1000:.1f}ms per step')
+    print(f'saved   : {(oneshot - session) / args.steps * 1000:.1f}ms per step')
+
+
+if __name__ == '__main__':
+    main()
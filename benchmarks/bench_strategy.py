@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+"""
+对比 linear 与 free 执行策略下，有一台慢主机时执行一个任务列表的耗时，使用本地替身主机
+每个任务所有主机耗时 --step 秒，慢主机的每个任务额外耗时 --slow 秒，且每个任务由不同的替身主机变慢
+用法：python benchmarks/bench_strategy.py --hosts 20 --tasks 5 --forks 20
+"""
+
+import os
+import argparse
+from common import local_inventory, timeit
+from app.ansible_api import MyAnsible
+
+
+def run_chain(inventory, forks, strategy, tasks, step, slow):
+    task_list = [dict(action=dict(module='shell', args=dict(
+        cmd=f"sleep {{{{ {step} + ({slow} if host_index | int == {i} else 0) }}}}"))) for i in range(tasks)]
+    with MyAnsible(inventory=inventory, forks=forks, strategy=strategy, verbosity=0) as myansible:
+        myansible.run_tasks(hosts='cdh_servers', tasks=task_list)
+        assert myansible.get_task_result().all_success()
+
+
+def main():
+    parse = argparse.ArgumentParser(description='benchmark linear and free strategy with a slow host per task')
+    parse.add_argument('--hosts', type=int, default=20, help='Number of stand-in hosts')
+    parse.add_argument('--tasks', type=int, default=5, help='Number of tasks in the task list')
+    parse.add_argument('--forks', type=int, default=20, help='Number of hosts ansible runs on in parallel')
+    parse.add_argument('--step', type=float, default=0.5, help='Seconds each task takes on every host')
+    parse.add_argument('--slow', type=float, default=2, help='Extra seconds each task takes on its slow host')
+    args = parse.parse_args()
+
+    inventory = local_inventory(args.hosts, host_vars=lambda i: f'host_index={i}')
+    try:
+        linear = timeit(run_chain, inventory, args.forks, 'linear', args.tasks, args.step, args.slow)
+        free = timeit(run_chain, inventory, args.forks, 'free', args.tasks, args.step, args.slow)
+    finally:
+        os.remove(inventory)
+
+    print(f'hosts={args.hosts} tasks={args.tasks} forks={args.forks}')
+    print(f'linear : {linear:.3f}s')
+    print(f'free   : {free:.3f}s')
+    print(f'speedup: {linear / free:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import sys
+import time
+import tempfile
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+if basedir not in sys.path:
+    sys.path.insert(0, basedir)
+
+
+def local_inventory(count, group='cdh_servers', host_vars=None):
+    """
+    生成 count 台本地替身主机的资产文件，所有主机都使用 local 连接
+    :param host_vars: 可选，参数为主机序号，返回该主机额外变量字符串的函数
+    :return: 资产文件路径
+    """
+    lines = [f'[{group}]'] + [_host_line(i, host_vars) for i in range(count)]
+    return _write_inventory(lines)
+
+
+def cluster_inventory(count, host_vars=None):
+    """
+    生成与 conf/hosts 分组相同的 count 台本地替身主机资产文件，
+    第一台主机为 scm_server 和 db_server，其余主机为 scm_agent
+    :param host_vars: 可选，参数为主机序号，返回该主机额外变量字符串的函数
+    :return: 资产文件路径
+    """
+    lines = ['[scm_server]', _host_line(0, host_vars), '[db_server]', 'standin0000', '[scm_agent]']
+    lines += [_host_line(i, host_vars) for i in range(1, count)]
+    lines += ['[cdh_servers:children]', 'scm_server', 'scm_agent']
+    return _write_inventory(lines)
+
+
+def _host_line(i, host_vars):
+    extra = f' {host_vars(i)}' if host_vars else ''
+    return f'standin{i:04d} ansible_connection=local ansible_python_interpreter={sys.executable} ' \
+           f'hostname=standin{i:04d}{extra}'
+
+
+def _write_inventory(lines):
+    fd, path = tempfile.mkstemp(prefix='bench_inventory_', text=True)
+    with os.fdopen(fd, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    return path
+
+
+def timeit(func, *args, **kwargs):
+    """
+    返回函数运行的墙钟时间（秒）
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
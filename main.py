@@ -4,102 +4,19 @@
 
 import sys
 import argparse
-from app.ansible_api import MyAnsible
-from app.log import check_log
-from app.ssh_without_pass import SSHWithoutPass
-from app.commom import set_config_by_ansible, set_ansible_by_config
-from app.config import config
-from app.task import BaseTemple, ScmServerTemple, ScmAgentTemple, DBTemple, get_yum_status_task, HATemple
+from collections import OrderedDict
 
 
-def servers_check(myansible, hosts):
+def read_hosts_file(path):
     """
-    检查服务器连通性和是否可以 yum 安装软件包
-    :param myansible: ansible 实例
-    :param hosts:：主机组标签
+    读取主机列表文件，每行一台或以 , 分隔的多台主机，忽略空行和 # 开头的注释
     """
-    exit_code = 0
-
-    # 检查 yum 是否正常
-    df = get_yum_status_task(myansible, hosts)
-
-    # 检查是否存在 yum 安装失败、主机不可达，存在任一错误，程序都将会退出
-    unreachable_server = df[df['ansible_run_status'] == 'unreachable']['host'].to_list()
-    failed_server = df[df['ansible_run_status'] == 'failed']['host'].to_list()
-
-    if unreachable_server:
-        check_log.error(f'{unreachable_server} is unreachable')
-        exit_code += 1
-    if failed_server:
-        check_log.error(f'{failed_server} is failed')
-        exit_code += 1
-
-    if exit_code > 0:
-        check_log.error('server check failed,the program will exit.')
-        sys.exit(1)
-    check_log.info('server check ok.')
-
-
-class CdhInstall(object):
-    def __init__(self, password):
-        self.password = password
-        self.port = config['ssh']['port']
-        self.user = config['ssh']['user']
-
-        if self.user != 'root':
-            self.myansible = MyAnsible(inventory='conf/hosts', remote_user=self.user,
-                                       become=True, become_method='sudo', become_user='root')
-            self.myansible.variable_manager.extra_vars.update({'ansible_become_password': self.password})
-        else:
-            self.myansible = MyAnsible(inventory='conf/hosts', remote_user=self.user)
-
-        self.__set_config()
-
-    def _ssh_distribute(self, hosts: list):
-        swp = SSHWithoutPass()
-        swp.distribute_ssh_key(hosts=hosts, user=self.user, password=self.password, port=self.port)
-
-    def __set_config(self):
-        set_config_by_ansible(self.myansible)
-        set_ansible_by_config(self.myansible)
-
-    def install(self):
-        host_list = self.myansible.inv_obj.get_hosts()
-        self._ssh_distribute(host_list)
-
-        servers_check(self.myansible, hosts='cdh_servers')
-
-        cdh_server = BaseTemple(self.myansible, hosts='cdh_servers')
-        cdh_server.run_task()
-
-        db_server = DBTemple(self.myansible, hosts='db_server')
-        db_server.run_task()
-
-        scm_server = ScmServerTemple(self.myansible, hosts='scm_server')
-        scm_server.run_task()
-
-        scm_agent = ScmAgentTemple(self.myansible, hosts='scm_agent')
-        scm_agent.run_task()
-
-        if config['ha']:
-            ha = HATemple(self.myansible, haproxy_hosts='haproxy_server')
-            ha.run_task()
-
-    def add_agent(self, hosts):
-        """
-        添加agent节点
-        :param hosts: 字符串格式，如果只有一台，则必须以 , 结尾，如192.168.100.200,
-        """
-        host_list = hosts.split(',')
-        self._ssh_distribute(host_list)
-
-        servers_check(self.myansible, hosts=hosts)
-
-        base_init = BaseTemple(self.myansible, hosts=hosts)
-        base_init.run_task()
-
-        scm_agent = ScmAgentTemple(self.myansible, hosts=hosts)
-        scm_agent.run_task()
+    host_list = []
+    with open(path) as file:
+        for line in file:
+            line = line.split('#', 1)[0]
+            host_list.extend(host.strip() for host in line.split(',') if host.strip())
+    return host_list
 
 
 if __name__ == '__main__':
@@ -119,11 +36,50 @@ if __name__ == '__main__':
         "--hosts",
         help='Server host list by add cloudera manager agent'
     )
+    parse.add_argument(
+        "--hosts-file",
+        help='File of server host list by add cloudera manager agent, one host per line'
+    )
+    parse.add_argument(
+        "--forks",
+        type=int,
+        help='Number of hosts ansible runs on in parallel'
+    )
+    parse.add_argument(
+        "--strategy",
+        choices=['linear', 'free'],
+        help='linear: each task waits for all hosts; free: each host runs its task list independently'
+    )
+    parse.add_argument(
+        "--wave-size",
+        type=int,
+        help='Number of hosts in each wave by add cloudera manager agent, 0 means all hosts in one wave'
+    )
+    parse.add_argument(
+        "--max-fail-percent",
+        type=int,
+        help='Abort add cloudera manager agent when the percent of failed hosts exceeds this value'
+    )
     parse.add_argument(
         "-p",
         "--password",
         help='Server password'
     )
+    parse.add_argument(
+        "--resume",
+        action="store_true",
+        help='Skip stages already finished on each host by the last run, according to the local install journal'
+    )
+    parse.add_argument(
+        "--plan",
+        action="store_true",
+        help='Only probe the hosts and print the stages, bytes to transfer and estimated duration, install nothing'
+    )
+    parse.add_argument(
+        "--measure",
+        action="store_true",
+        help='With --plan, copy a test file to each host to measure throughput, the file is removed afterwards'
+    )
     parse.add_argument(
         "--ha",
         action="store_true",
@@ -132,20 +88,48 @@ if __name__ == '__main__':
 
     args = parse.parse_args()
 
-    if args.ha:
-        config['ha'] = True
+    if args.plan and not (args.install or args.add):
+        parse.error('--plan requires --install or --add')
+    if args.measure and not args.plan:
+        parse.error('--measure requires --plan')
 
     if not args.password:
         print('Server password is need, please configure -p | --password argument')
         sys.exit(2)
 
+    # 参数检查通过后才加载配置和安装模块，--help 和参数错误不读取配置、不导入 ansible
+    from app.config import config
+
+    if args.ha:
+        config['ha'] = True
+    if args.forks:
+        config['ssh']['forks'] = args.forks
+    if args.strategy:
+        config['strategy'] = args.strategy
+    if args.wave_size is not None:
+        config['add_agent']['wave_size'] = args.wave_size
+    if args.max_fail_percent is not None:
+        config['add_agent']['max_fail_percent'] = args.max_fail_percent
+
     if args.install:
-        cdh = CdhInstall(args.password)
-        cdh.install()
+        from app.install import CdhInstall
+        cdh = CdhInstall(args.password, resume=args.resume)
+        if args.plan:
+            cdh.plan(measure=args.measure)
+        else:
+            cdh.install()
 
     if args.add:
-        if not args.hosts:
-            print('Server host list is need by add agent, please configure --hosts argument')
+        add_hosts = [host.strip() for host in (args.hosts or '').split(',') if host.strip()]
+        if args.hosts_file:
+            add_hosts.extend(read_hosts_file(args.hosts_file))
+
+        if not add_hosts:
+            print('Server host list is need by add agent, please configure --hosts or --hosts-file argument')
         else:
-            cdh = CdhInstall(args.password)
-            cdh.add_agent(args.hosts)
+            from app.install import CdhInstall
+            cdh = CdhInstall(args.password, resume=args.resume)
+            if args.plan:
+                cdh.plan(list(OrderedDict.fromkeys(add_hosts)), measure=args.measure)
+            else:
+                cdh.add_agent(list(OrderedDict.fromkeys(add_hosts)))
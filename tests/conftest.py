@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import os
+import sys
+import logging
+import pytest
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+if basedir not in sys.path:
+    sys.path.insert(0, basedir)
+
+from app import log
+
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    # 测试中不写 logs/install.log
+    for name in ('check_log', 'ssh_distribute_log', 'install_log'):
+        monkeypatch.setattr(getattr(log, name), '_logger', logging.getLogger(f'test.{name}'))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import pytest
+from ansible.inventory.manager import InventoryManager
+from ansible.parsing.dataloader import DataLoader
+from ansible.vars.manager import VariableManager
+from app.inventory import InventoryIndex
+
+
+@pytest.fixture
+def inventory(tmp_path):
+    path = tmp_path / 'hosts'
+    path.write_text('[scm_server]\n10.0.0.1 hostname=node0001\n'
+                    '[scm_agent]\n10.0.0.2 hostname=node0002 ansible_port=2222\n'
+                    '[cdh_servers:children]\nscm_server\nscm_agent\n'
+                    '[cdh_servers:vars]\nansible_port=22\nansible_user=root\n')
+    (tmp_path / 'group_vars').mkdir()
+    (tmp_path / 'group_vars/cdh_servers.yml').write_text('ansible_user: cdh\nansible_become: true\n')
+    (tmp_path / 'host_vars').mkdir()
+    (tmp_path / 'host_vars/10.0.0.2.yml').write_text('hostname: agent0002\nansible_user: deploy\n')
+
+    loader = DataLoader()
+    return loader, InventoryManager(loader=loader, sources=str(path))
+
+
+def test_group_and_host_vars_files(inventory):
+    loader, inv_obj = inventory
+    index = InventoryIndex(inv_obj, loader)
+
+    # group_vars 文件覆盖资产文件中的组变量，host_vars 文件覆盖资产文件中的主机变量
+    assert index.var('10.0.0.1', 'ansible_user') == 'cdh'
+    assert index.var('10.0.0.1', 'ansible_become') is True
+    assert index.var('10.0.0.2', 'ansible_user') == 'deploy'
+    assert index.var('10.0.0.2', 'ansible_port') == 2222
+    assert index.hostname('10.0.0.2') == 'agent0002'
+    assert index.host('agent0002') == '10.0.0.2'
+    assert index.host('node0002') is None
+
+
+def test_same_as_variable_manager(inventory):
+    loader, inv_obj = inventory
+    index = InventoryIndex(inv_obj, loader)
+    variable_manager = VariableManager(loader, inv_obj)
+
+    for host in inv_obj.get_hosts():
+        host_vars = variable_manager.get_vars(host=host)
+        for name, value in index.host_vars[host.get_name()].items():
+            assert host_vars[name] == value
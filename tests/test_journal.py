@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import pytest
+from app import journal
+from app.checksum import ChecksumIndex
+from app.config import config
+from app.journal import InstallJournal
+
+
+def install_stage(myansible, hosts):
+    pass
+
+
+@pytest.fixture
+def stage_file(tmp_path, monkeypatch):
+    # 阶段用到的文件和校验值索引都放在临时目录，不写入项目的 packages 目录
+    path = tmp_path / 'install.sh'
+    path.write_text('echo 1\n')
+    monkeypatch.setattr(journal, 'stage_inputs', lambda func: [str(path)])
+    monkeypatch.setattr(journal, 'checksum_index', ChecksumIndex(str(tmp_path / 'index.json')))
+    return path
+
+
+def test_record_and_finished(tmp_path):
+    records = InstallJournal(str(tmp_path / 'logs/journal.db'))
+    records.record('install_stage', 'hash1', ['node1', 'node2'])
+
+    assert records.finished('install_stage', 'hash1', ['node1', 'node3']) == {'node1'}
+    assert records.finished('install_stage', 'hash2', ['node1', 'node2']) == set()
+    assert records.finished('other_stage', 'hash1', ['node1']) == set()
+    records.close()
+
+
+def test_stage_durations_median(tmp_path):
+    records = InstallJournal(str(tmp_path / 'journal.db'))
+    for duration in (10, 30, 20):
+        records.record_timing('install_stage', 3, duration)
+    records.record_timing('other_stage', 1, 5)
+
+    assert records.stage_durations() == {'install_stage': 20, 'other_stage': 5}
+    records.close()
+
+
+def test_input_hash_follows_file_content(stage_file):
+    before = InstallJournal.input_hash(install_stage, (), {})
+    assert InstallJournal.input_hash(install_stage, (), {}) == before
+
+    stage_file.write_text('echo 2\n')
+    assert InstallJournal.input_hash(install_stage, (), {}) != before
+
+
+def test_input_hash_ignores_inventory_and_runtime_keys(stage_file, monkeypatch):
+    before = InstallJournal.input_hash(install_stage, (), {})
+
+    monkeypatch.setitem(config, 'host', [{'ip': '192.168.1.10', 'name': 'node10'}])
+    monkeypatch.setitem(config, 'parallel_stages', 1)
+    assert InstallJournal.input_hash(install_stage, (), {}) == before
+
+    monkeypatch.setitem(config, 'ntp_external_server', '192.168.1.1')
+    assert InstallJournal.input_hash(install_stage, (), {}) != before
+    assert InstallJournal.input_hash(install_stage, ('cdh_servers',), {}) != \
+        InstallJournal.input_hash(install_stage, ('scm_agent',), {})
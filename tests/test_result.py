@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+from app.result import PROBE_VARS, ResultStore, compact_result, truncate_output
+from app.ansible_api import ResultCallback
+
+
+class FakeHost(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakeTask(object):
+    def __init__(self, name, task_vars=None):
+        self.name = name
+        self.vars = task_vars or {}
+        self._uuid = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakeResult(object):
+    """
+    替代 ansible 的 TaskResult，只提供回调用到的属性
+    """
+    def __init__(self, host, task, result):
+        self._host = FakeHost(host)
+        self._task = task
+        self._result = result
+
+
+def test_truncate_output_keeps_head_and_tail():
+    value = 'a' * 10 + 'b' * 80 + 'c' * 10
+    truncated = truncate_output(value, 20)
+    assert truncated.startswith('a' * 10) and truncated.endswith('c' * 10)
+    assert '80 characters truncated' in truncated
+    assert truncate_output('short', 20) == 'short'
+    assert truncate_output(None, 20) is None
+
+
+def test_compact_result_drops_unused_keys_and_items():
+    result = {'rc': 1, 'stdout': 'x' * 100, 'stdout_lines': ['x' * 100], 'invocation': {},
+              'results': [{'item': 'a', 'stderr': 'y' * 100, 'diff': {}}, 'raw']}
+    compact = compact_result(result, 10)
+    assert set(compact) == {'rc', 'stdout', 'results'}
+    assert len(compact['stdout']) < 100
+    assert set(compact['results'][0]) == {'item', 'stderr'}
+    assert compact['results'][1] == 'raw'
+
+
+def test_result_store_tracks_first_failure_and_latest():
+    store = ResultStore()
+    store.add('node1', 'failed', {'rc': 1})
+    store.add('node2', 'success', {'rc': 0})
+    store.add('node1', 'success', {'rc': 0})
+    store.add('node3', 'unreachable', {})
+
+    assert len(store) == 4
+    assert store.hosts() == ['node1', 'node2', 'node3']
+    assert store.failed_hosts() == ['node1', 'node3']
+    assert store.failed_hosts('unreachable') == ['node3']
+    assert store.latest('node1') == ('node1', 'success', {'rc': 0})
+    assert store.select(status='success', hosts=['node2']) == [('node2', 'success', {'rc': 0})]
+    assert not store.all_success()
+
+
+def test_failure_output_spilled_to_host_file(tmp_path):
+    callback = ResultCallback(max_output=10, failure_dir=str(tmp_path))
+    callback.stage = 'install_jdk_task[cdh_servers]'
+    task = FakeTask('install jdk')
+    callback.v2_runner_on_failed(FakeResult('node1', task, {'rc': 1, 'stdout': 'x' * 100, 'stderr': 'boom'}))
+    callback.v2_runner_on_ok(FakeResult('node2', task, {'rc': 0, 'stdout': 'ok'}))
+
+    _, status, result = callback.results.latest('node1')
+    assert status == 'failed'
+    assert len(result['stdout']) < 100
+    assert result['output_file'] == str(tmp_path / 'node1.log')
+    content = (tmp_path / 'node1.log').read_text()
+    assert 'install_jdk_task[cdh_servers] install jdk failed' in content
+    assert 'x' * 100 in content and 'boom' in content
+    assert 'output_file' not in callback.results.latest('node2')[2]
+    assert not (tmp_path / 'node2.log').exists()
+
+
+def test_probe_failure_not_spilled(tmp_path):
+    callback = ResultCallback(failure_dir=str(tmp_path))
+    callback.v2_runner_on_failed(FakeResult('node1', FakeTask('verify parcels', PROBE_VARS), {'rc': 1}))
+
+    assert callback.results.failed_hosts() == ['node1']
+    assert 'output_file' not in callback.results.latest('node1')[2]
+    assert not list(tmp_path.iterdir())
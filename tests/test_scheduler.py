@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Author: Yujichang
+
+import fnmatch
+from app.scheduler import TaskGraph, requires
+from app.journal import InstallJournal
+
+
+class FakeHost(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakeInventory(object):
+    def __init__(self, groups):
+        self.groups = groups
+        self.excluded = set()
+
+    def get_hosts(self, pattern='all'):
+        hosts = []
+        for part in pattern.split(','):
+            if part in self.groups:
+                hosts.extend(self.groups[part])
+            else:
+                hosts.extend(host for hosts in self.groups.values() for host in hosts
+                             if fnmatch.fnmatch(host, part))
+        return [FakeHost(host) for host in dict.fromkeys(hosts) if host not in self.excluded]
+
+    def subset(self, patterns):
+        self.excluded = {pattern[1:] for pattern in patterns if pattern.startswith('!')}
+
+
+class FakeCallback(object):
+    stage = None
+
+
+class FakeAnsible(object):
+    """
+    替代 MyAnsible，只提供任务图用到的属性，任务函数直接修改 failed_hosts
+    """
+    def __init__(self, groups):
+        self.inv_obj = FakeInventory(groups)
+        self.results_callback = FakeCallback()
+        self.failed_hosts = set()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+GROUPS = {
+    'cdh_servers': ['node1', 'node2', 'node3'],
+    'db_server': ['node1'],
+    'scm_server': ['node1'],
+    'scm_agents': ['node2', 'node3'],
+}
+
+
+def stage(name, fail=(), requires_stages=(), cluster=()):
+    """
+    生成桩任务函数：在子进程中把执行记录写入文件，并把 fail 中的主机记为失败
+    """
+    def func(myansible, hosts, trace):
+        targets = sorted(host.get_name() for host in myansible.inv_obj.get_hosts(pattern=hosts))
+        with open(trace, 'a') as f:
+            f.write(f'{name} {",".join(targets)}\n')
+        myansible.failed_hosts.update(set(fail) & set(targets))
+    func.__name__ = name
+    return requires(*requires_stages, cluster=cluster)(func)
+
+
+def read_trace(path):
+    if not path.exists():
+        return []
+    return [line.split(' ') for line in path.read_text().splitlines()]
+
+
+def test_requires_order(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base')
+    config = stage('config', requires_stages=(base,))
+    graph = TaskGraph(FakeAnsible(GROUPS))
+    graph.add(base, 'scm_agents', str(trace))
+    graph.add(config, 'cdh_servers', str(trace))
+    graph.add(config, 'scm_server', str(trace))
+
+    status = graph.run()
+
+    assert list(status.values()) == ['success'] * 3
+    assert read_trace(trace) == [['base', 'node2,node3'], ['config', 'node1,node2,node3'], ['config', 'node1']]
+
+
+def test_partial_failure_excludes_failed_hosts(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base', fail=('node2',))
+    config = stage('config', requires_stages=(base,))
+    myansible = FakeAnsible(GROUPS)
+    graph = TaskGraph(myansible)
+    graph.add(base, 'cdh_servers', str(trace))
+    graph.add(config, 'cdh_servers', str(trace))
+
+    status = graph.run()
+
+    assert list(status.values()) == ['success', 'success']
+    assert myansible.failed_hosts == {'node2'}
+    assert read_trace(trace) == [['base', 'node1,node2,node3'], ['config', 'node1,node3']]
+
+
+def test_all_hosts_failed_marks_stage_failed(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base', fail=('node2', 'node3'))
+    config = stage('config', requires_stages=(base,))
+    graph = TaskGraph(FakeAnsible(GROUPS))
+    graph.add(base, 'scm_agents', str(trace))
+    graph.add(config, 'scm_agents', str(trace))
+
+    status = graph.run()
+
+    assert status == {'base[scm_agents]': 'failed', 'config[scm_agents]': 'skipped'}
+    assert [name for name, _ in read_trace(trace)] == ['base']
+
+
+def test_failed_cluster_prerequisite_skips_dependents(tmp_path):
+    trace = tmp_path / 'trace'
+    database = stage('database', fail=('node1',))
+    server = stage('server', cluster=(database,))
+    agent = stage('agent')
+    graph = TaskGraph(FakeAnsible(GROUPS))
+    graph.add(database, 'db_server', str(trace))
+    graph.add(server, 'scm_server', str(trace))
+    graph.add(agent, 'scm_agents', str(trace))
+
+    status = graph.run()
+
+    assert status['database[db_server]'] == 'failed'
+    assert status['server[scm_server]'] == 'skipped'
+    assert status['agent[scm_agents]'] == 'success'
+
+
+def test_partially_failed_cluster_prerequisite_skips_dependents(tmp_path):
+    trace = tmp_path / 'trace'
+    database = stage('database', fail=('node2',))
+    server = stage('server', cluster=(database,))
+    graph = TaskGraph(FakeAnsible(GROUPS))
+    graph.add(database, 'cdh_servers', str(trace))
+    graph.add(server, 'scm_server', str(trace))
+
+    status = graph.run()
+
+    assert status == {'database[cdh_servers]': 'success', 'server[scm_server]': 'skipped'}
+
+
+def test_stage_exception_marks_failed(tmp_path):
+    def broken(myansible, hosts):
+        raise RuntimeError('broken')
+    after = stage('after', requires_stages=(broken,))
+    graph = TaskGraph(FakeAnsible(GROUPS))
+    graph.add(broken, 'cdh_servers')
+    graph.add(after, 'cdh_servers', str(tmp_path / 'trace'))
+
+    status = graph.run()
+
+    assert status == {'broken[cdh_servers]': 'failed', 'after[cdh_servers]': 'skipped'}
+
+
+def test_max_fail_percent_aborts_remaining(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base', fail=('node2', 'node3'))
+    config = stage('config', requires_stages=(base,))
+    graph = TaskGraph(FakeAnsible(GROUPS), max_workers=1, max_fail_percent=50)
+    graph.add(base, 'cdh_servers', str(trace))
+    graph.add(config, 'cdh_servers', str(trace))
+
+    status = graph.run()
+
+    assert status == {'base[cdh_servers]': 'success', 'config[cdh_servers]': 'skipped'}
+
+
+WAVE_GROUPS = {
+    'cdh_servers': ['node1', 'node2'],
+    'new': ['node3', 'node4', 'node5', 'node6'],
+}
+
+
+def test_per_wave_etc_hosts_stages_are_ordered(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base')
+    etc_hosts = stage('etc_hosts', requires_stages=(base,))
+    graph = TaskGraph(FakeAnsible(WAVE_GROUPS), max_workers=4)
+
+    def plan(wave):
+        graph.add(base, wave, str(trace))
+        graph.add(etc_hosts, f'cdh_servers,{wave}', str(trace))
+
+    graph.pipeline(['node3,node4,', 'node5,node6,'], plan)
+    first, second = [node for node in graph.nodes if node.func is etc_hosts]
+    assert first in second.deps and first in second.order_only
+
+    status = graph.run()
+
+    assert set(status.values()) == {'success'}
+    lines = [line for line in read_trace(trace) if line[0] == 'etc_hosts']
+    assert lines == [['etc_hosts', 'node1,node2,node3,node4'], ['etc_hosts', 'node1,node2,node5,node6']]
+
+
+def test_failed_wave_not_journaled_and_next_wave_runs(tmp_path):
+    trace = tmp_path / 'trace'
+    base = stage('base', fail=('node3', 'node4'))
+    agent = stage('agent', requires_stages=(base,))
+    journal = InstallJournal(str(tmp_path / 'journal.db'))
+    graph = TaskGraph(FakeAnsible(WAVE_GROUPS), journal=journal)
+
+    def plan(wave):
+        graph.add(base, wave, str(trace))
+        graph.add(agent, wave, str(trace))
+
+    graph.pipeline(['node3,node4,', 'node5,node6,'], plan)
+    status = graph.run()
+
+    assert status == {'base[node3,node4,]': 'failed', 'agent[node3,node4,]': 'skipped',
+                      'base[node5,node6,]': 'success', 'agent[node5,node6,]': 'success'}
+    base_hash = journal.input_hash(base, (str(trace),), {})
+    assert journal.finished('base', base_hash, WAVE_GROUPS['new']) == {'node5', 'node6'}
+    journal.close()
+
+
+def test_fail_budget_counts_only_target_hosts(tmp_path):
+    groups = {'cdh_servers': ['node1', 'node2', 'node3'], 'new': ['node4', 'node5']}
+    base = stage('base', fail=('node4',))
+    etc_hosts = stage('etc_hosts', requires_stages=(base,))
+
+    def run(target_hosts):
+        trace = tmp_path / f'trace_{target_hosts is not None}'
+        graph = TaskGraph(FakeAnsible(groups), max_fail_percent=40, target_hosts=target_hosts)
+
+        def plan(wave):
+            graph.add(base, wave, str(trace))
+            graph.add(etc_hosts, f'cdh_servers,{wave}', str(trace))
+
+        graph.pipeline(['node4,', 'node5,'], plan)
+        return graph.run()
+
+    # 所有任务的主机共 5 台，1 台失败未超过 40%
+    assert run(None)['base[node5,]'] == 'success'
+
+    # 只按新增的 2 台主机计算，1 台失败超过 40%，后续批次不再执行
+    status = run(['node4', 'node5'])
+    assert status['base[node4,]'] == 'failed'
+    assert status['base[node5,]'] == 'skipped'
+    assert status['etc_hosts[cdh_servers,node5,]'] == 'skipped'